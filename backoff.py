@@ -0,0 +1,54 @@
+"""This module decides how long to wait before reconnecting to Twitter after the stream stops.
+Following Twitter's guidelines for the streaming API, each kind of failure backs off
+differently. Network errors back off linearly, since they are usually brief. HTTP errors back
+off exponentially, and being rate limited backs off exponentially from a whole minute, since
+every attempt to connect while rate limited makes the limit last longer. Each delay is
+lengthened by a random amount so that reconnections do not fall into step with anything
+else."""
+
+import random
+
+
+NETWORK = 'network'
+HTTP = 'http'
+RATE_LIMIT = 'rate_limit'
+# Error class -> (first delay, longest delay, whether the delay doubles or grows linearly)
+BACKOFF_POLICIES = {
+    NETWORK: (0.25, 16, False),
+    HTTP: (5, 320, True),
+    RATE_LIMIT: (60, 960, True),
+}
+# Largest share of a delay that is added at random
+JITTER = 0.25
+
+
+class Backoff:
+    """The delays between successive reconnections after one class of error. The first delay
+    is initial seconds, and each one after it is either double the last, if exponential is
+    True, or initial seconds longer, up to maximum seconds."""
+
+    def __init__(self, initial, maximum, exponential=True):
+        self.initial = initial
+        self.maximum = maximum
+        self.exponential = exponential
+        self.delay = initial
+
+    def next_delay(self):
+        """Returns the number of seconds to wait before the next reconnection, and lengthens
+        the delay for the one after it."""
+
+        delay = self.delay
+        self.delay = min(self.delay * 2 if self.exponential else self.delay + self.initial,
+                         self.maximum)
+        return delay * (1 + random.uniform(0, JITTER))
+
+    def reset(self):
+        """Starts again from the first delay, after a successful connection."""
+
+        self.delay = self.initial
+
+
+def get_backoffs():
+    """Returns a dict of a new Backoff for each error class in BACKOFF_POLICIES."""
+
+    return {error_class: Backoff(*policy) for error_class, policy in BACKOFF_POLICIES.items()}
@@ -0,0 +1,111 @@
+"""Compares loading the classifiers from their pickles with loading the memory-mapped model
+bundle. Each load runs in a fresh process, which reports how long loading and classifying one
+batch of reviews took, and its resident memory afterwards. On Linux it also reports
+proportional set size (PSS), which splits shared pages between the processes using them, for
+several processes loading the bundle at once. Run it from the root of the repository after
+the bundle has been built (starting the program once builds it):
+
+    python -m benchmarks.bench_model_load
+"""
+
+import multiprocessing
+import os
+import pickle
+import time
+
+BUNDLE_FILEPATH = os.path.join('pickles', 'models.bundle')
+PROCESSES = 4
+
+
+def main():
+
+    # Spawned processes start without any modules imported, like a fresh program would
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    for load_function in (_load_pickles, _load_bundle):
+        barrier = context.Barrier(PROCESSES)
+        processes = [context.Process(target=_measure, args=(load_function, results, barrier))
+                     for _ in range(PROCESSES)]
+        for process in processes:
+            process.start()
+        measurements = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        load_time = sum(m['load_time'] for m in measurements) / PROCESSES
+        classify_time = sum(m['classify_time'] for m in measurements) / PROCESSES
+        rss = sum(m['rss'] for m in measurements) / PROCESSES
+        print(f"{load_function.__doc__.strip()}: load {load_time:.3f}s, first batch "
+              f"{classify_time:.3f}s, RSS {rss/1024:.1f} MB per process", end='')
+        if all(m['pss'] is not None for m in measurements):
+            print(f", PSS {sum(m['pss'] for m in measurements)/1024:.1f} MB "
+                  f"for {PROCESSES} processes", end='')
+        print()
+
+
+def _measure(load_function, results, barrier):
+    """Loads the models with load_function, classifies a batch of reviews with them, and puts
+    the measurements in results. Importing the modules the models need counts as loading.
+    Waits at barrier until the other processes have finished loading before measuring memory,
+    and again afterwards, so that PSS reflects the sharing between them."""
+
+    from data import DataSet
+
+    # Build the features before timing so that only loading and classifying are measured
+    documents = []
+    DataSet._load_movie_reviews(documents)
+    feature_matrix = DataSet.find_feature_matrix([document for document, _ in documents[:500]],
+                                                 DataSet.get_feature_index())
+    start = time.perf_counter()
+    models = load_function()
+    load_time = time.perf_counter() - start
+    for model in models:
+        model(feature_matrix)
+    classify_time = time.perf_counter() - start - load_time
+
+    barrier.wait()
+    results.put({'load_time': load_time, 'classify_time': classify_time,
+                 'rss': _read_memory('/proc/self/status', 'VmRSS'),
+                 'pss': _read_memory('/proc/self/smaps_rollup', 'Pss')})
+    # Keep the models mapped while the other processes measure their memory
+    barrier.wait()
+
+
+def _load_pickles():
+    """Pickles"""
+
+    models = []
+    for filename in sorted(os.listdir('pickles')):
+        if filename.endswith('.pickle') and not filename.startswith('features'):
+            with open(os.path.join('pickles', filename), 'rb') as pickle_file:
+                classifier = pickle.load(pickle_file)
+            models.append(lambda X, c=classifier: c._encoder.classes_[c._clf.predict(X)])
+    return models
+
+
+def _load_bundle():
+    """Model bundle"""
+
+    from modelbundle import ModelBundle
+
+    bundle = ModelBundle.load(BUNDLE_FILEPATH)
+    return [model.predict for model in bundle.models]
+
+
+def _read_memory(filepath, field):
+    """Returns the value in kB of field from a /proc memory file, or None if it is not
+    available."""
+
+    try:
+        with open(filepath) as memory_file:
+            for line in memory_file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+if __name__ == '__main__':
+    main()
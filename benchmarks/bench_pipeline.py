@@ -0,0 +1,169 @@
+"""Load-tests the classification pipeline by replaying a file of tweets into it at a chosen
+rate, without connecting to Twitter. The tweets go through the same KeywordStreamListener and
+classification processes that main.py starts, and the results are collected where the graphing
+process would read them. Reports the sustained throughput, the end-to-end latency percentiles
+from the listener queueing a tweet to its result arriving, and the fraction of tweets that were
+dropped because the classifiers could not keep up. Run it from the root of the repository:
+
+    python -m benchmarks.bench_pipeline positive.txt --rate 500 --mode bursty --workers 2
+
+--transport shm sends the tweets through the shared memory ring buffers instead of
+multiprocessing queues.
+"""
+
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Stop waiting for results once none have arrived for this many seconds after the last tweet
+DRAIN_TIMEOUT = 5
+
+
+class _TimedQueue:
+    """Wraps a queue and records the time each numbered tweet was put in it."""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.put_times = {}
+
+    def put(self, item):
+        self.put_times[item[0]] = time.time()
+        self.queue.put(item)
+
+    def put_many(self, items):
+        put_time = time.time()
+        for item in items:
+            self.put_times[item[0]] = put_time
+        if hasattr(self.queue, 'put_many'):
+            self.queue.put_many(items)
+        else:
+            for item in items:
+                self.queue.put(item)
+
+
+def main():
+
+    args = _parse_args()
+
+    from classification import start_classify
+    from ringbuffer import ResultRing, TweetRing
+    from sources import ReplayStream
+    from streamlistener import KeywordStreamListener
+    from votingclassifier import VotingClassifier
+
+    if multiprocessing.get_start_method() == 'fork':
+        VotingClassifier()
+
+    if args.transport == 'shm':
+        stream_to_classify = TweetRing()
+        classify_to_graph = ResultRing()
+    else:
+        stream_to_classify = multiprocessing.Queue()
+        classify_to_graph = multiprocessing.Queue()
+    classification_processes = [multiprocessing.Process(target=start_classify,
+                                                        args=(stream_to_classify,
+                                                              classify_to_graph),
+                                                        kwargs={'cascade': args.cascade})
+                                for _ in range(args.workers)]
+    for classification_process in classification_processes:
+        classification_process.start()
+
+    timed_queue = _TimedQueue(stream_to_classify)
+    stream = ReplayStream(KeywordStreamListener(timed_queue), args.corpus, args.rate,
+                          args.mode, loop=True, limit=args.tweets)
+    stream_thread = threading.Thread(target=stream.filter, daemon=True)
+    stream_thread.start()
+
+    arrivals = _collect_results(classify_to_graph, timed_queue.put_times, stream_thread)
+
+    for classification_process in classification_processes:
+        classification_process.terminate()
+        classification_process.join()
+
+    _report(timed_queue.put_times, arrivals)
+    if args.transport == 'shm':
+        print(f"Ring buffer overflows: {stream_to_classify.overflow_count} tweets, "
+              f"{classify_to_graph.overflow_count} results")
+        stream_to_classify.unlink()
+        classify_to_graph.unlink()
+
+
+def _collect_results(result_queue, put_times, stream_thread):
+    """Reads results from result_queue until every tweet that was sent has a result, or until
+    none have arrived for DRAIN_TIMEOUT seconds after the stream finished. Returns a dict of
+    sequence number -> (arrival time, whether the tweet was classified)."""
+
+    arrivals = {}
+    last_arrival = time.time()
+    while stream_thread.is_alive() or len(arrivals) < len(put_times):
+        try:
+            sequence_number, result = result_queue.get(timeout=0.1)
+        except queue.Empty:
+            if not stream_thread.is_alive() and time.time() - last_arrival > DRAIN_TIMEOUT:
+                break
+            continue
+        last_arrival = time.time()
+        arrivals[sequence_number] = (last_arrival, result is not None)
+    return arrivals
+
+
+def _report(put_times, arrivals):
+    """Prints the throughput, latency and drop rate of the tweets sent at put_times."""
+
+    sent = len(put_times)
+    if not sent:
+        print('No tweets were sent')
+        return
+
+    latencies = np.array([arrival_time - put_times[sequence_number]
+                          for sequence_number, (arrival_time, classified) in arrivals.items()
+                          if classified])
+    dropped = sum(1 for _, classified in arrivals.values() if not classified)
+    lost = sent - len(arrivals)
+
+    first_put = min(put_times.values())
+    send_time = max(put_times.values()) - first_put
+    total_time = max([arrival_time for arrival_time, _ in arrivals.values()] + [first_put]) \
+        - first_put
+
+    print(f"Sent {sent} tweets in {send_time:.2f}s ({sent/max(send_time, 1e-9):.1f} tweets/s)")
+    print(f"Classified {len(latencies)} tweets in {total_time:.2f}s "
+          f"({len(latencies)/max(total_time, 1e-9):.1f} tweets/s)")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(f"Latency: p50 {p50:.1f}ms, p95 {p95:.1f}ms, p99 {p99:.1f}ms, "
+              f"max {latencies.max()*1000:.1f}ms")
+    print(f"Dropped {dropped + lost} tweets ({(dropped + lost)/sent:.2%}): {dropped} pushed out "
+          f"of a full batch, {lost} with no result")
+
+
+def _parse_args():
+    """Returns the parsed command line arguments."""
+
+    from sources import RATE_MODES
+
+    parser = argparse.ArgumentParser(description='Load-test the classification pipeline.')
+    parser.add_argument('corpus', help='file of tweets to replay, one per line as JSON or '
+                                       'plain text')
+    parser.add_argument('--rate', type=float, default=200,
+                        help='tweets per second to send (default: 200)')
+    parser.add_argument('--mode', choices=RATE_MODES, default='fixed',
+                        help='how the tweets are spaced out (default: fixed)')
+    parser.add_argument('--tweets', type=int, default=5000,
+                        help='number of tweets to send (default: 5000)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of classification processes (default: 1)')
+    parser.add_argument('--cascade', action='store_true',
+                        help='classify with the early-exit cascade')
+    parser.add_argument('--transport', choices=('queue', 'shm'), default='queue',
+                        help='multiprocessing queues or shared memory ring buffers between '
+                             'the processes (default: queue)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
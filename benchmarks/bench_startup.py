@@ -0,0 +1,144 @@
+"""Times how long the program takes to classify its first tweet after the keywords have been
+typed in, with each way of starting the processes. Each run is a fresh interpreter, so the
+imports are timed as well, and typing the keywords is simulated by waiting --typing-time
+seconds. Run it from the root of the repository:
+
+    python -m benchmarks.bench_startup positive.txt --runs 5
+
+The modes are:
+
+    old-fork   main.py before --warm-start, with fork (the default on Linux). Every module was
+               imported before the prompt, and the models were loaded after it.
+    old-spawn  main.py before --warm-start, with spawn (the default on macOS and Windows).
+               Every child process imported every module again, and each classification
+               process loaded the models after the stream had started.
+    fork       main.py with fork. The models are loaded before the prompt.
+    spawn      main.py with spawn. Each process only imports what it uses.
+    warm       main.py with --warm-start. A forkserver loads the models during the prompt.
+"""
+
+import os
+import time
+
+# Taken before anything else is imported, so that the imports are included in the timings
+START_TIME = time.time()
+
+# The old main.py imported everything at the top, so every spawned process imported it too
+if os.environ.get('BENCH_STARTUP_IMPORT_ALL'):
+    import classification
+    import dashboard
+    import graphing
+
+import argparse
+import multiprocessing
+import statistics
+import subprocess
+import sys
+
+MODES = ('old-fork', 'old-spawn', 'fork', 'spawn', 'warm')
+
+
+def main():
+
+    args = _parse_args()
+    if args.mode:
+        print(*_time_to_first_classification(args.corpus, args.mode, args.rate,
+                                              args.typing_time))
+        return
+
+    print(f"Time to the first classification, median of {args.runs} runs, with "
+          f"{args.typing_time}s to type the keywords:")
+    for mode in MODES:
+        timings = [_run_in_new_interpreter(args.corpus, mode, args.rate, args.typing_time)
+                   for _ in range(args.runs)]
+        after_keywords = statistics.median(timing[0] for timing in timings)
+        after_start = statistics.median(timing[1] for timing in timings)
+        print(f"{mode:10} {after_keywords:.2f}s after the keywords, "
+              f"{after_start:.2f}s after starting")
+
+
+def _run_in_new_interpreter(corpus, mode, rate, typing_time):
+    """Runs _time_to_first_classification in a new Python interpreter, and returns what it
+    returned."""
+
+    environment = dict(os.environ)
+    if mode.startswith('old-'):
+        environment['BENCH_STARTUP_IMPORT_ALL'] = '1'
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', corpus,
+                             '--mode', mode, '--rate', str(rate),
+                             '--typing-time', str(typing_time)],
+                            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            text=True, env=environment).stdout
+    return tuple(float(timing) for timing in output.split()[-2:])
+
+
+def _time_to_first_classification(corpus, mode, rate, typing_time):
+    """Starts a replay of corpus and one classification process the way main.py does in the
+    given mode, after waiting typing_time seconds at the point where main.py prompts for the
+    keywords. Returns the number of seconds from the end of the prompt, and from the start of
+    the interpreter, until the first classified tweet arrives."""
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import main
+    from sources import get_source
+
+    worker_context = multiprocessing
+    target = main._start_classify
+    if mode == 'warm':
+        worker_context = main._start_forkserver()
+    else:
+        multiprocessing.set_start_method(mode.replace('old-', ''))
+        if mode == 'fork':
+            import preload
+
+    time.sleep(typing_time)
+    keywords_time = time.time()
+
+    if mode == 'old-fork':
+        from votingclassifier import VotingClassifier
+        VotingClassifier()
+    if mode.startswith('old-'):
+        target = classification.start_classify
+
+    stream_to_classify = multiprocessing.Queue()
+    classify_to_graph = multiprocessing.Queue()
+    streaming_process = multiprocessing.Process(target=get_source(corpus, rate),
+                                                args=([], stream_to_classify))
+    streaming_process.start()
+    classification_process = worker_context.Process(target=target,
+                                                    args=(stream_to_classify,
+                                                          classify_to_graph))
+    classification_process.start()
+
+    while classify_to_graph.get()[1] is None:
+        pass
+    first_classification_time = time.time()
+
+    streaming_process.terminate()
+    classification_process.terminate()
+    streaming_process.join()
+    classification_process.join()
+    return first_classification_time - keywords_time, first_classification_time - START_TIME
+
+
+def _parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Time how long the program takes to classify '
+                                                 'its first tweet.')
+    parser.add_argument('corpus', help='file of tweets to replay, one per line as JSON or '
+                                       'plain text')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='number of times each mode is timed (default: 3)')
+    parser.add_argument('--rate', type=float, default=50,
+                        help='tweets per second to replay (default: 50)')
+    parser.add_argument('--typing-time', type=float, default=3,
+                        help='seconds spent typing in the keywords (default: 3)')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Compares the tokenizers in tokenizer.py. It reports how long each one takes to find the
+words in every review of the training corpus, and how often TweetTokenizer finds the same
+feature list words as NLTK's word_tokenize. Run it from the root of the repository:
+
+    python -m benchmarks.bench_tokenizer
+"""
+
+import time
+
+from data import DataSet
+from tokenizer import CachedTokenizer, NltkTokenizer, TweetTokenizer
+
+
+def main():
+
+    documents = []
+    DataSet._load_movie_reviews(documents)
+    documents = [document for document, _ in documents]
+    feature_words = set(DataSet.get_feature_list())
+
+    nltk_words, nltk_time = _time_tokenizer(NltkTokenizer(), documents, feature_words)
+    tweet_words, tweet_time = _time_tokenizer(TweetTokenizer(), documents, feature_words)
+    print(f"word_tokenize:  {nltk_time:.3f}s for {len(documents)} documents")
+    print(f"TweetTokenizer: {tweet_time:.3f}s ({nltk_time/tweet_time:.1f}x faster)")
+
+    matching = sum(a == b for a, b in zip(nltk_words, tweet_words))
+    shared = sum(len(a & b) for a, b in zip(nltk_words, tweet_words))
+    total = sum(len(a | b) for a, b in zip(nltk_words, tweet_words))
+    print(f"Documents with identical feature words: {matching}/{len(documents)}")
+    print(f"Feature word agreement (Jaccard): {shared/total:.4f}")
+
+    # Simulate a stream where each tweet is seen about 4 times, like retweeted campaigns
+    repeated = documents[:len(documents)//4] * 4
+    cached_tokenizer = CachedTokenizer(TweetTokenizer())
+    _, cached_time = _time_tokenizer(cached_tokenizer, repeated, feature_words)
+    _, uncached_time = _time_tokenizer(TweetTokenizer(), repeated, feature_words)
+    hit_rate = cached_tokenizer.hits / (cached_tokenizer.hits + cached_tokenizer.misses)
+    print(f"Repeated documents: {uncached_time:.3f}s uncached, {cached_time:.3f}s cached "
+          f"(hit rate {hit_rate:.0%})")
+
+
+def _time_tokenizer(tokenizer, documents, feature_words):
+    """Returns the feature words tokenizer finds in each document, and the time taken."""
+
+    start = time.perf_counter()
+    words = [tokenizer.get_words(document) for document in documents]
+    elapsed = time.perf_counter() - start
+    return [document_words & feature_words for document_words in words], elapsed
+
+
+if __name__ == '__main__':
+    main()
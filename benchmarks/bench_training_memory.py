@@ -0,0 +1,92 @@
+"""Compares the peak memory of building the training data as a list of featureset dicts, which
+SklearnClassifier.train then turns into a matrix with a DictVectorizer, against building the
+sparse training matrix directly. Each build runs in a fresh process, which reports how far its
+peak resident memory rose above where it started. Run it from the root of the repository:
+
+    python -m benchmarks.bench_training_memory [number of documents]
+
+The featureset dicts for the whole corpus take many gigabytes, so a smaller number of
+documents can be given.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('documents', type=int, nargs='?', default=None,
+                        help='number of documents to use (default: all of them)')
+    args = parser.parse_args()
+
+    # Spawned processes start without any modules imported, like a fresh program would
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    for build_function in (_build_featureset_dicts, _build_training_matrix):
+        process = context.Process(target=_measure,
+                                  args=(build_function, args.documents, results))
+        process.start()
+        peak, build_time = results.get()
+        process.join()
+        print(f"{build_function.__doc__.strip()}: peak memory +{peak/1024:.1f} MB, "
+              f"time {build_time:.2f}s")
+
+
+def _measure(build_function, document_count, results):
+    """Builds the training data from the first document_count documents with build_function,
+    half positive and half negative, and puts its peak memory increase in kB and
+    the time taken in results."""
+
+    from data import DataSet
+
+    DataSet.processes = 1
+    documents = []
+    DataSet._load_movie_reviews(documents)
+    if document_count is not None:
+        documents = documents[:document_count//2] + documents[-(document_count//2):]
+    feature_index = DataSet.get_feature_index()
+
+    start_memory = _get_peak_memory()
+    start = time.perf_counter()
+    data = build_function(documents, feature_index)
+    build_time = time.perf_counter() - start
+    results.put((_get_peak_memory() - start_memory, build_time))
+    del data
+
+
+def _build_featureset_dicts(documents, feature_index):
+    """List of featureset dicts"""
+
+    from data import DataSet
+    from sklearn.feature_extraction import DictVectorizer
+
+    word_list = list(feature_index)
+    featuresets = [{word: (word in words) for word in word_list}
+                   for words in DataSet._get_words_of_documents(
+                       [document for document, _ in documents])]
+    return featuresets, DictVectorizer().fit_transform(featuresets)
+
+
+def _build_training_matrix(documents, feature_index):
+    """Sparse training matrix"""
+
+    from data import DataSet
+
+    return DataSet._build_training_matrix(documents, feature_index)
+
+
+def _get_peak_memory():
+    """Returns the peak resident memory of this process in kB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes rather than kB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Reports how the number of words kept by feature selection affects the held-out accuracy,
+size and classification speed of the models, so that ClassifierTrainer.max_features or
+ClassifierTrainer.min_feature_score can be set to a smaller, faster operating point. Run it
+from the root of the repository:
+
+    python -m benchmarks.bench_vocabulary --method chi2 --sizes 500 1000 2000 5000
+
+The reviews are split into a training set and a held-out test set. For each size, the words
+are scored on the training set only, the best ones are kept, and all of the classifiers are
+trained on them and scored on the test set by majority vote. The last row keeps every word.
+The lowest score kept is the min_feature_score that keeps the same words. Throughput is the
+number of test reviews classified per second, in batches the size the classification processes
+use. The reviews are tokenized once beforehand, so it measures how the vocabulary changes
+building the features and running the models, rather than tokenizing.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+SEED = 0
+
+
+def main():
+
+    args = _parse_args()
+
+    from data import DataSet
+
+    documents = []
+    DataSet._load_movie_reviews(documents)
+    feature_index = DataSet.get_feature_index()
+    words = sorted(feature_index, key=feature_index.get)
+    matrix = DataSet._build_training_matrix(documents, feature_index)
+    labels = np.array([sentiment for _, sentiment in documents])
+
+    rows = np.random.RandomState(SEED).permutation(len(documents))
+    test_count = int(len(documents) * args.test_size)
+    test_rows, training_rows = rows[:test_count], rows[test_count:]
+    test_documents = [documents[row][0] for row in test_rows]
+
+    start = time.perf_counter()
+    scores = DataSet._score_features(matrix[training_rows], labels[training_rows],
+                                     args.method)
+    print(f"Scored {len(words)} words with {args.method} in {time.perf_counter()-start:.2f}s, "
+          f"{len(training_rows)} training and {test_count} held-out reviews")
+    print(f"{'Words':>7} {'Lowest score':>12} {'Accuracy':>9} {'Training':>9} "
+          f"{'Bundle':>9} {'Throughput':>16}")
+
+    sizes = sorted(size for size in set(args.sizes) if size < len(words)) + [len(words)]
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            columns = DataSet._choose_features(scores, max_features=size)
+            accuracy, training_time, bundle_size, throughput = _evaluate(
+                [words[column] for column in columns], matrix[training_rows][:, columns],
+                labels[training_rows], test_documents, labels[test_rows],
+                os.path.join(directory, f'models-{size}.bundle'), args.runs)
+            print(f"{size:7} {scores[columns].min():12.4g} {accuracy:9.2%} "
+                  f"{training_time:8.1f}s {bundle_size/1024/1024:7.2f}MB "
+                  f"{throughput:10.0f} rev/s")
+
+
+def _evaluate(word_list, training_matrix, training_labels, test_documents, test_labels,
+              bundle_filepath, runs):
+    """Trains every classifier on training_matrix, whose columns are the words in word_list,
+    and classifies test_documents with them through a model bundle, like the program does.
+    Returns the accuracy of the votes, the training time, the size of the bundle in bytes,
+    and the fastest number of test documents classified per second over runs runs."""
+
+    from classification import BATCH_SIZE
+    from data import DataSet
+    from modelbundle import ModelBundle
+    from trainer import ClassifierTrainer
+    from votingclassifier import VotingClassifier
+
+    DataSet.feature_list = word_list
+    DataSet.feature_index = None
+
+    start = time.perf_counter()
+    named_classifiers = ClassifierTrainer._get_named_classifiers(
+        VotingClassifier.classifier_list)
+    ClassifierTrainer._wrap_named_classifiers(named_classifiers)
+    ClassifierTrainer._train_classifiers(named_classifiers, training_matrix, training_labels)
+    training_time = time.perf_counter() - start
+
+    ModelBundle.export(bundle_filepath,
+                       [named_classifier.name for named_classifier in named_classifiers],
+                       [named_classifier.classifier for named_classifier in named_classifiers])
+    ClassifierTrainer.trained_models = ModelBundle.load(bundle_filepath).models
+    classifier = VotingClassifier()
+    ClassifierTrainer.trained_models = []
+
+    def classify():
+        labels = []
+        for start in range(0, len(test_documents), BATCH_SIZE):
+            feature_matrix = DataSet.find_feature_matrix(
+                test_documents[start:start + BATCH_SIZE], DataSet.get_feature_index())
+            labels.extend(classifier.classify_matrix(feature_matrix)[0])
+        return labels
+
+    # The first run also tokenizes the documents, which every size shares
+    accuracy = np.mean(np.array(classify()) == test_labels)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        classify()
+        times.append(time.perf_counter() - start)
+
+    return accuracy, training_time, os.path.getsize(bundle_filepath), \
+        len(test_documents) / min(times)
+
+
+def _parse_args():
+    """Returns the parsed command line arguments."""
+
+    from data import DataSet
+
+    parser = argparse.ArgumentParser(description='Compare the accuracy and speed of the '
+                                                 'models for different vocabulary sizes.')
+    parser.add_argument('--method', choices=DataSet.feature_selection_methods, default='chi2',
+                        help='how the words are scored (default: chi2)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000],
+                        help='numbers of words to keep (default: 250 500 1000 2000 4000)')
+    parser.add_argument('--test-size', type=float, default=0.2,
+                        help='fraction of the reviews held out for testing (default: 0.2)')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='number of times the classification is timed (default: 3)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Times the parts of the program that run most often or take the longest, and compares the
+times with a saved baseline so that a change that makes one of them slower is caught. The
+inputs are reviews sampled from positive.txt and negative.txt with a fixed seed, so every run
+measures the same work. Each benchmark is run repeatedly and its fastest time is kept, since
+the slower runs are slowed down by whatever else the machine was doing.
+
+Run it from the root of the repository after the classifiers have been trained (starting the
+program once trains them). Save a baseline before making a change, then run the suite again
+afterwards. It exits with an error if any benchmark is more than --tolerance slower than the
+baseline:
+
+    python -m benchmarks.suite --save-baseline
+    python -m benchmarks.suite
+
+Baselines are only comparable on the same machine, so they are not checked in. -k only runs
+the groups of benchmarks (data, trainer, classify or graphing) whose names contain the given
+text:
+
+    python -m benchmarks.suite -k classify
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+RESULTS_FILEPATH = os.path.join('benchmarks', 'results.json')
+BASELINE_FILEPATH = os.path.join('benchmarks', 'baseline.json')
+SEED = 0
+DOCUMENTS = 200
+# Each benchmark is run at least MIN_RUNS times, and until MIN_TIME seconds have been timed
+MIN_RUNS = 5
+MIN_TIME = 0.2
+MAX_RUNS = 10000
+# Differences smaller than this many seconds are timer noise, not regressions
+NOISE_FLOOR = 1e-5
+
+
+def main():
+
+    args = _parse_args()
+
+    random.seed(SEED)
+    np.random.seed(SEED)
+    documents = _get_documents()
+
+    results = {}
+    for group_name, benchmark_group in BENCHMARK_GROUPS:
+        if args.k and args.k not in group_name:
+            continue
+        for name, setup, run in benchmark_group(documents):
+            results[name] = _measure(setup, run)
+            print(f"{name:45} {results[name]['best']*1000:10.3f}ms")
+
+    output = {'python': platform.python_version(), 'machine': platform.machine(),
+              'documents': DOCUMENTS, 'seed': SEED, 'results': results}
+    output_filepath = BASELINE_FILEPATH if args.save_baseline else RESULTS_FILEPATH
+    with open(output_filepath, 'w') as output_file:
+        json.dump(output, output_file, indent=2, sort_keys=True)
+    print(f"Saved results to {output_filepath}")
+
+    if not args.save_baseline and _find_regressions(results, args.tolerance):
+        sys.exit(1)
+
+
+def _get_documents():
+    """Returns DOCUMENTS reviews sampled from positive.txt and negative.txt with SEED."""
+
+    from data import DataSet
+
+    documents = []
+    DataSet._load_movie_reviews(documents)
+    return [document for document, _ in random.Random(SEED).sample(documents, DOCUMENTS)]
+
+
+def _measure(setup, run):
+    """Calls run repeatedly, calling setup before each call without timing it. Returns the
+    fastest and median time of a call, and how many calls were timed."""
+
+    times = []
+    while len(times) < MIN_RUNS or (sum(times) < MIN_TIME and len(times) < MAX_RUNS):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+def _find_regressions(results, tolerance):
+    """Compares results with the saved baseline and prints the benchmarks that changed.
+    Returns True if any of them are more than tolerance slower than the baseline."""
+
+    if not os.path.isfile(BASELINE_FILEPATH):
+        print("No baseline to compare with. Save one with --save-baseline")
+        return False
+
+    with open(BASELINE_FILEPATH) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+
+    regressed = False
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['best'], result['best']
+        change = after / before - 1 if before else 0.0
+        if change > tolerance and after - before > NOISE_FLOOR:
+            print(f"REGRESSION {name}: {before*1000:.3f}ms -> {after*1000:.3f}ms "
+                  f"({change:+.0%})")
+            regressed = True
+        elif change < -tolerance and before - after > NOISE_FLOOR:
+            print(f"Improved   {name}: {before*1000:.3f}ms -> {after*1000:.3f}ms "
+                  f"({change:+.0%})")
+
+    if not regressed:
+        print(f"No benchmark is more than {tolerance:.0%} slower than the baseline")
+    return regressed
+
+
+def _benchmark_data(documents):
+    """Yields the (name, setup, run) benchmarks of building featuresets."""
+
+    from data import DataSet
+    from tokenizer import CachedTokenizer
+
+    def unload_feature_list():
+        DataSet.feature_list = None
+        DataSet.feature_index = None
+
+    def clear_tokenizer_cache():
+        if isinstance(DataSet.tokenizer, CachedTokenizer):
+            DataSet.tokenizer.cache.clear()
+
+    yield 'data.get_feature_list.cold', unload_feature_list, DataSet.get_feature_list
+    yield 'data.get_feature_list.warm', None, DataSet.get_feature_list
+
+    feature_list = DataSet.get_feature_list()
+    feature_index = DataSet.get_feature_index()
+    yield 'data.find_features', clear_tokenizer_cache, \
+        lambda: [DataSet.find_features(document, feature_list) for document in documents]
+    yield 'data.find_feature_matrix', clear_tokenizer_cache, \
+        lambda: DataSet.find_feature_matrix(documents, feature_index)
+
+
+def _benchmark_trainer(documents):
+    """Yields the (name, setup, run) benchmarks of loading the trained classifiers. Cold loads
+    read them from disk, warm loads return the copies that are already loaded."""
+
+    from trainer import ClassifierTrainer
+    from votingclassifier import VotingClassifier
+
+    classifier_list = VotingClassifier.classifier_list
+
+    def unload_classifiers():
+        ClassifierTrainer.trained_classifiers = []
+
+    def unload_models():
+        ClassifierTrainer.trained_models = []
+
+    yield 'trainer.get_trained_classifiers.cold', unload_classifiers, \
+        lambda: ClassifierTrainer.get_trained_classifiers(classifier_list)
+    yield 'trainer.get_trained_classifiers.warm', None, \
+        lambda: ClassifierTrainer.get_trained_classifiers(classifier_list)
+    unload_classifiers()
+
+    yield 'trainer.get_trained_models.cold', unload_models, \
+        lambda: ClassifierTrainer.get_trained_models(classifier_list)
+    yield 'trainer.get_trained_models.warm', None, \
+        lambda: ClassifierTrainer.get_trained_models(classifier_list)
+
+
+def _benchmark_classify(documents):
+    """Yields the (name, setup, run) benchmarks of classifying each document on its own with
+    every model, and with the VotingClassifier."""
+
+    from data import DataSet
+    from votingclassifier import VotingClassifier
+
+    feature_list = DataSet.get_feature_list()
+    feature_index = DataSet.get_feature_index()
+    featuresets = [DataSet.find_features(document, feature_list) for document in documents]
+    vectors = [DataSet.find_feature_vector(document, feature_index) for document in documents]
+    classifier = VotingClassifier()
+
+    for model in classifier.classifiers:
+        yield f'classify.{model.name}', None, \
+            lambda model=model: [model.predict(vector) for vector in vectors]
+    yield 'classify.VotingClassifier', None, \
+        lambda: [classifier.classify(featureset) for featureset in featuresets]
+    yield 'classify.VotingClassifier.vector', None, \
+        lambda: [classifier.classify_vector(vector) for vector in vectors]
+    matrix = DataSet.find_feature_matrix(documents, feature_index)
+    yield 'classify.VotingClassifier.matrix', None, lambda: classifier.classify_matrix(matrix)
+
+
+def _benchmark_graphing(documents):
+    """Yields the (name, setup, run) benchmarks of updating the graphs from a full window of
+    classified tweets."""
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    import graphing
+    from sentimentwindow import CountWindow, TimeWindow
+    from wordcounter import WordCounter, get_stopwords, render_word_cloud
+
+    rng = random.Random(SEED)
+    recent_tweets = [(document, rng.choice(('pos', 'neg')), rng.random())
+                     for document in documents[:graphing.MAX_TWEETS]]
+    averages = graphing._init_averages()
+    count_window = CountWindow(graphing.MAX_TWEETS)
+    # Spread the tweets over the last 60 seconds
+    time_window = TimeWindow(60)
+    now = time.time()
+    for number, (_, sentiment, confidence) in enumerate(recent_tweets):
+        count_window.add(sentiment, confidence, now - 60 + number * 60 / len(recent_tweets))
+        time_window.add(sentiment, confidence, now - 60 + number * 60 / len(recent_tweets))
+    word_counter = WordCounter(graphing.MAX_TWEETS, get_stopwords())
+
+    def add_tweets(window):
+        for _, sentiment, confidence in recent_tweets:
+            window.add(sentiment, confidence)
+
+    def add_texts():
+        for text, _, _ in recent_tweets:
+            word_counter.add(text)
+
+    add_texts()
+    frequencies = word_counter.get_frequencies()
+    word_cloud = graphing.WordCloudRenderer(plt.figure().add_subplot(111))
+
+    def finish_layout():
+        if word_cloud.layout is None:
+            word_cloud.render(frequencies)
+        word_cloud.layout.result()
+
+    def show_layout():
+        finish_layout()
+        word_cloud.show_finished()
+
+    yield 'graphing._get_average_sentiment', None, \
+        lambda: graphing._get_average_sentiment(count_window, averages)
+    yield 'sentimentwindow.CountWindow.add', None, lambda: add_tweets(count_window)
+    yield 'sentimentwindow.TimeWindow.add', None, lambda: add_tweets(time_window)
+    yield 'wordcounter.WordCounter.add', None, add_texts
+    yield 'wordcounter.WordCounter.get_frequencies', None, word_counter.get_frequencies
+    yield 'wordcounter.render_word_cloud', None, lambda: render_word_cloud(frequencies)
+    # The time the graphs stall for to update the word cloud, while the layout itself runs in
+    # another process. The undecorated function is used, since the decorator skips calls made
+    # within its interval.
+    yield 'graphing._update_word_cloud', show_layout, \
+        lambda: graphing._update_word_cloud.__wrapped__(word_cloud, word_counter)
+    yield 'graphing.WordCloudRenderer.show_finished', finish_layout, word_cloud.show_finished
+    word_cloud.close()
+
+
+def _parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Time the program and compare the times with '
+                                                 'a saved baseline.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help=f'save the results as the baseline, {BASELINE_FILEPATH}')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction a benchmark may slow down by before it counts as a '
+                             'regression (default: 0.25)')
+    parser.add_argument('-k', metavar='TEXT',
+                        help='only run the groups of benchmarks whose names contain TEXT')
+    return parser.parse_args()
+
+
+BENCHMARK_GROUPS = [('data', _benchmark_data), ('trainer', _benchmark_trainer),
+                    ('classify', _benchmark_classify), ('graphing', _benchmark_graphing)]
+
+
+if __name__ == '__main__':
+    main()
@@ -1,56 +1,197 @@
 """This file classifies tweets that are sent to it from the streaming module. It then sends
-the data to the graphing module."""
+the data to the graphing module. Several classification processes can share the same input
+and output queues. Tweets arrive as (sequence number, text, keywords) tuples, and results are
+sent on with the same sequence number so that the graphing module can put them back in order.
+The tweets of every tracked keyword share the same classifiers, and the keywords each tweet
+belongs to are passed through so that the results can be split up by keyword."""
+
+import logging
+import time
 
 from collections import deque
 
 from data import DataSet
+from metrics import Metrics
+from queueing import drain
+from resultcache import ResultCache
 from votingclassifier import VotingClassifier
 
 
-def start_classify(input_queue, output_queue):
-    """Pulls tweets from input_queue, classifies them, and puts the result in output_queue."""
+BATCH_SIZE = 64
+BATCH_TIMEOUT = 0.1
+IDLE_TIMEOUT = 1
+MAX_DRAIN = 1000
+CACHE_SIZE = 10000
+CACHE_TTL = 600
+CACHE_LOG_INTERVAL = 60
+# Seconds between checks for updated models
+MODEL_CHECK_INTERVAL = 1
+
+
+def start_classify(input_queue, output_queue, batch_size=BATCH_SIZE,
+                   batch_timeout=BATCH_TIMEOUT, near_duplicates=False, cascade=False,
+                   metrics_queue=None, storage_queue=None, stop_event=None):
+    """Pulls tweets from input_queue, classifies them, and puts the result in output_queue.
+    If a VotingClassifier has already been loaded in the parent process, a forked process will
+    reuse its models instead of loading its own copy. Tweets are classified in batches of up to
+    batch_size tweets. Once the first tweet of a batch arrives, at most batch_timeout seconds
+    are spent waiting for the batch to fill. Results are cached so that duplicate tweets are
+    not classified again. If near_duplicates is True, tweets that are almost the same as a
+    cached tweet also reuse its result. If cascade is True, each tweet stops being classified
+    as soon as its majority vote is decided, see VotingClassifier. Metrics are sent to
+    metrics_queue, if it is given. If storage_queue is given, each batch of results is also
+    sent to it as a whole, with the time it was classified, to be saved by the storage
+    module. When the models are updated, such as by the updater module, the new models are
+    swapped in between two batches, and the cached results of the old ones are forgotten. Runs
+    until stop_event is set, if it is given, after sending on the batch it was classifying."""
 
     # I use a maxlen deque to ensure that we don't fall too far behind the stream. If the
     # stream is sending tweets faster than they can be classified, then some tweets will
     # be lost
-    tweets = deque(maxlen=5)
-    classifier = VotingClassifier()
-
-    while True:
-
-        _get_tweets(input_queue, tweets)
-        classified_tweets = _classify_tweets(classifier, tweets)
-        _output_data(output_queue, classified_tweets)
-
-
-def _get_tweets(input_queue, tweets_deque):
-    """Takes all of the tweets in the input_queue and adds them to tweets_deque."""
+    Metrics.connect(metrics_queue)
+    tweets = deque(maxlen=batch_size)
+    classifier = VotingClassifier(cascade=cascade)
+    cache = ResultCache(CACHE_SIZE, CACHE_TTL, near_duplicates)
+    last_log_time = time.time()
+    last_model_check_time = time.time()
+
+    while stop_event is None or not stop_event.is_set():
+
+        dropped_tweets = _get_batch(input_queue, tweets, batch_timeout)
+        classified_tweets = _classify_tweets(classifier, cache, tweets)
+        _output_data(output_queue, classified_tweets, dropped_tweets)
+        if storage_queue is not None and classified_tweets:
+            storage_queue.put((time.time(), classified_tweets))
+        Metrics.increment('tweets_classified_total', len(classified_tweets))
+        Metrics.increment('tweets_dropped_total', len(dropped_tweets))
+
+        if time.time() - last_log_time > CACHE_LOG_INTERVAL:
+            _log_stats(classifier, cache)
+            last_log_time = time.time()
+
+        if time.time() - last_model_check_time > MODEL_CHECK_INTERVAL:
+            classifier = _swap_models(classifier, cache)
+            last_model_check_time = time.time()
+
+    # By the time this process is stopped, the graphing process has exited, so nothing will
+    # read the results still waiting to be sent to it. Dropping them means this process cannot
+    # block on a full pipe as it exits. The storage queue is still read, and is flushed
+    cancel_join_thread = getattr(output_queue, 'cancel_join_thread', None)
+    if cancel_join_thread is not None:
+        cancel_join_thread()
+    logging.debug("Stopped classifying tweets")
+
+
+def _get_batch(input_queue, tweets_deque, batch_timeout):
+    """Waits for tweets from input_queue, then adds them to tweets_deque until it is full or
+    batch_timeout seconds have passed since it received its first tweet. Returns a list of the
+    tweets that were pushed out of tweets_deque to make room for newer ones."""
+
+    dropped_tweets = []
+    _get_tweets(input_queue, tweets_deque, dropped_tweets, IDLE_TIMEOUT)
+    if not tweets_deque:
+        return dropped_tweets
+
+    deadline = time.time() + batch_timeout
+    while len(tweets_deque) < tweets_deque.maxlen:
+        remaining = deadline - time.time()
+        if remaining <= 0 or not _get_tweets(input_queue, tweets_deque, dropped_tweets,
+                                             remaining):
+            break
+
+    return dropped_tweets
+
+
+def _get_tweets(input_queue, tweets_deque, dropped_tweets, timeout):
+    """Waits up to timeout seconds for tweets in input_queue, then takes all of the tweets that
+    are waiting and adds them to tweets_deque. A tweet with no text was dropped by a full ring
+    buffer, so it goes straight to dropped_tweets. Returns the number of tweets taken."""
+
+    tweets = drain(input_queue, timeout, MAX_DRAIN)
+    for tweet in tweets:
+        if tweet[1] is None:
+            dropped_tweets.append(tweet)
+        else:
+            _add_tweet(tweets_deque, tweet, dropped_tweets)
+    return len(tweets)
 
-    while not input_queue.empty():
-        tweets_deque.append(input_queue.get())
 
+def _add_tweet(tweets_deque, tweet, dropped_tweets):
+    """Appends tweet to tweets_deque. If tweets_deque is full, the oldest tweet in it is moved
+    to dropped_tweets."""
 
-def _classify_tweets(classifier, tweets):
-    """Uses classifier to classify all tweets. Returns a list of tweets whose classification
-    confidence was greater than MIN_ALLOWED_CONFIDENCE."""
+    if len(tweets_deque) == tweets_deque.maxlen:
+        dropped_tweets.append(tweets_deque[0])
+    tweets_deque.append(tweet)
 
-    classified_tweets = []
 
-    for tweet in tweets:
-        feature_list = DataSet.get_feature_list()
-        features = DataSet.find_features(tweet, feature_list)
-        classification = classifier.classify(features)
-        confidence = classifier.get_most_recent_confidence()
+def _classify_tweets(classifier, cache, tweets):
+    """Uses classifier to classify all tweets as a single batch. Tweets with a result in cache
+    are not classified again. If the cascade stopped early for a tweet, its confidence is only
+    a lower bound, which is flagged in its result. These results are not cached, so the cache
+    only ever holds exact confidences. Returns a list of (sequence number, (tweet,
+    classification, confidence, keywords, confidence is a lower bound)) tuples."""
 
-        classified_tweets.append((tweet, classification, confidence))
+    if not tweets:
+        return []
 
+    sequence_numbers, batch, keywords = zip(*tweets)
     tweets.clear()
 
-    return classified_tweets
-
-
-def _output_data(output_queue, data):
-    """Puts the classified tweet tuples from data into output_queue."""
-
-    for classified_tweet in data:
-        output_queue.put(classified_tweet)
+    results = [cache.get(tweet) for tweet in batch]
+    uncached = [i for i, result in enumerate(results) if result is None]
+    lower_bounds = [False] * len(batch)
+
+    if uncached:
+        feature_index = DataSet.get_feature_index()
+        features = DataSet.find_feature_matrix([batch[i] for i in uncached], feature_index)
+        classifications, confidences = classifier.classify_matrix(features)
+        for row, (i, classification, confidence) in enumerate(zip(uncached, classifications,
+                                                                  confidences)):
+            results[i] = (classification, confidence)
+            lower_bounds[i] = classifier.cascade and classifier.confidence_is_lower_bound[row]
+            if not lower_bounds[i]:
+                cache.add(batch[i], results[i])
+
+    return [(sequence_number,
+             (tweet, classification, confidence, tweet_keywords, lower_bounds[i]))
+            for i, (sequence_number, tweet, (classification, confidence), tweet_keywords)
+            in enumerate(zip(sequence_numbers, batch, results, keywords))]
+
+
+def _swap_models(classifier, cache):
+    """Returns a classifier with the updated models if they have changed, clearing cache of
+    the old models' results, or classifier itself if they have not."""
+
+    updated_classifier = classifier.get_updated_classifier()
+    if updated_classifier is None:
+        return classifier
+    cache.clear()
+    Metrics.increment('model_swaps_total')
+    logging.debug("Swapped in the updated models")
+    return updated_classifier
+
+
+def _log_stats(classifier, cache):
+    """Logs how often duplicate tweets were found in cache, and how many classifier
+    evaluations the cascade has skipped."""
+
+    logging.debug(f"Result cache: {cache.hits} hits, {cache.near_hits} near-duplicate hits, "
+                  f"{cache.misses} misses, hit rate {cache.get_hit_rate():.1%}")
+    if classifier.cascade:
+        logging.debug(f"Cascade skipped {classifier.total_evaluations_saved} evaluations")
+
+
+def _output_data(output_queue, data, dropped_tweets):
+    """Puts the numbered, classified tweet tuples from data into output_queue. The sequence
+    numbers of dropped_tweets are sent with None so that the graphing module does not wait for
+    them."""
+
+    items = [(sequence_number, None) for sequence_number, *_ in dropped_tweets] + data
+    # A ring buffer can write the whole batch at once
+    put_many = getattr(output_queue, 'put_many', None)
+    if put_many is not None:
+        put_many(items)
+        return
+    for item in items:
+        output_queue.put(item)
@@ -0,0 +1,210 @@
+"""This module is a headless alternative to the graphing module, for running the program on a
+server. Instead of drawing the graphs in a matplotlib window, it serves a web page that draws
+them in the browser, and streams the running average sentiment and the most common words to
+every viewer as Server-Sent Events. All of the viewers share the same stream and classifiers.
+
+Each viewer gets a small buffer of events. If a viewer cannot keep up, its oldest events are
+dropped rather than holding up the other viewers or using more and more memory. Every event
+is a complete update, so a dropped event only means one missing point on that viewer's
+graph."""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from collections import deque
+
+from metrics import Metrics
+from ordering import ReorderBuffer
+from queueing import drain
+from sentimentwindow import CountWindow, TimeWindow
+from wordcounter import WordCounter, get_stopwords
+
+
+HOST = '127.0.0.1'
+PORT = 8080
+PAGE_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static',
+                             'dashboard.html')
+MAX_TWEETS = 200
+MAX_AVERAGES = 100
+# Seconds between the points of the sentiment graph
+AVERAGE_INTERVAL = 1
+WORDS_UPDATE_INTERVAL = 10
+MAX_WORDS = 50
+# Events held for each viewer before the oldest are dropped
+CLIENT_BUFFER_SIZE = 64
+# Seconds between comments sent to idle viewers, so that proxies do not close the connection
+KEEPALIVE_INTERVAL = 15
+REQUEST_TIMEOUT = 10
+QUEUE_TIMEOUT = 0.1
+MAX_DRAIN = 1000
+
+
+def start_dashboard(queue, keywords, metrics_queue=None, host=HOST, port=PORT,
+                    window_seconds=None):
+    """Serves the dashboard for the list keywords at http://host:port/, updated with the
+    classified tweets pulled from queue. Runs until the process is stopped. Metrics are sent to
+    metrics_queue, if it is given. window_seconds is used the same way as in
+    graphing.start_graph."""
+
+    Metrics.connect(metrics_queue)
+    dashboard = Dashboard(keywords, window_seconds)
+    # asyncio.run needs Python 3.7, and asyncio.get_event_loop no longer creates a loop when
+    # none is running in newer versions
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(dashboard.serve(queue, host, port))
+
+
+class Dashboard:
+
+    def __init__(self, keywords, window_seconds=None):
+        self.keywords = list(keywords)
+        self.reorder_buffer = ReorderBuffer()
+        self.sentiment_windows = {keyword: TimeWindow(window_seconds) if window_seconds
+                                  else CountWindow(MAX_TWEETS) for keyword in self.keywords}
+        self.word_counter = WordCounter(MAX_TWEETS, get_stopwords())
+
+        # The latest updates, sent to each viewer when it connects
+        self.averages = deque(maxlen=MAX_AVERAGES)
+        self.words = {}
+        # A bounded queue of encoded events for each connected viewer
+        self.clients = set()
+
+        with open(PAGE_FILEPATH, 'rb') as page_file:
+            self.page = page_file.read()
+
+    async def serve(self, queue, host, port):
+        """Serves viewers while reading tweets from queue and publishing updates. Runs
+        forever."""
+
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logging.debug(f"Serving dashboard at http://{host}:{port}/")
+        try:
+            await asyncio.gather(self._read_tweets(queue), self._publish_averages(),
+                                 self._publish_words())
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def _read_tweets(self, queue):
+        """Adds the classified tweets from queue to the word counter and to the sentiment
+        window of each keyword they belong to, in the order they arrived from the stream. The
+        queue is read on another thread so that waiting for it does not block the viewers."""
+
+        loop = asyncio.get_event_loop()
+        while True:
+            numbered_tweets = await loop.run_in_executor(None, drain, queue, QUEUE_TIMEOUT,
+                                                         MAX_DRAIN)
+            for numbered_tweet in numbered_tweets:
+                for tweet in self.reorder_buffer.add(*numbered_tweet):
+                    # tweet is (text, sentiment, confidence, keywords, confidence is a
+                    # lower bound)
+                    self.word_counter.add(tweet[0])
+                    for keyword in tweet[3]:
+                        self.sentiment_windows[keyword].add(tweet[1], tweet[2])
+
+    async def _publish_averages(self):
+        """Sends the average sentiment and tweet rate of each keyword to every viewer every
+        AVERAGE_INTERVAL seconds."""
+
+        while True:
+            average = {'time': time.time(),
+                       'positivity': {keyword: window.get_positivity()
+                                      for keyword, window in self.sentiment_windows.items()},
+                       'rate': {keyword: window.get_rate()
+                                for keyword, window in self.sentiment_windows.items()}}
+            self.averages.append(average)
+            self._broadcast('average', average)
+            await asyncio.sleep(AVERAGE_INTERVAL)
+
+    async def _publish_words(self):
+        """Sends the most common words to every viewer every WORDS_UPDATE_INTERVAL seconds."""
+
+        while True:
+            await asyncio.sleep(WORDS_UPDATE_INTERVAL)
+            self.words = self.word_counter.get_frequencies(MAX_WORDS)
+            self._broadcast('words', self.words)
+
+    def _broadcast(self, event, data):
+        """Adds an event to the buffer of every viewer. If a viewer's buffer is full, its
+        oldest event is dropped to make room."""
+
+        message = Dashboard._encode_event(event, data)
+        for client in self.clients:
+            if client.full():
+                client.get_nowait()
+            client.put_nowait(message)
+
+    async def _handle_connection(self, reader, writer):
+        """Answers one HTTP request. / is the page, and /events is the stream of updates."""
+
+        try:
+            path = await asyncio.wait_for(Dashboard._read_request(reader), REQUEST_TIMEOUT)
+            if path == '/':
+                Dashboard._write_response(writer, '200 OK', 'text/html; charset=utf-8',
+                                          self.page)
+            elif path == '/events':
+                await self._stream_events(writer)
+            else:
+                Dashboard._write_response(writer, '404 Not Found', 'text/plain', b'Not found')
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream_events(self, writer):
+        """Sends the current state to a new viewer, then each event from its buffer until it
+        disconnects."""
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n')
+        writer.write(Dashboard._encode_event('state', {'keywords': self.keywords,
+                                                       'max_averages': MAX_AVERAGES,
+                                                       'averages': list(self.averages),
+                                                       'words': self.words}))
+
+        client = asyncio.Queue(CLIENT_BUFFER_SIZE)
+        self.clients.add(client)
+        logging.debug(f"Dashboard viewer connected, {len(self.clients)} connected")
+        try:
+            while True:
+                await writer.drain()
+                try:
+                    message = await asyncio.wait_for(client.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    message = b': keepalive\n\n'
+                writer.write(message)
+        finally:
+            self.clients.discard(client)
+            logging.debug(f"Dashboard viewer disconnected, {len(self.clients)} connected")
+
+    @staticmethod
+    async def _read_request(reader):
+        """Reads an HTTP request and returns its path. Raises ValueError if it is not a GET
+        request."""
+
+        request_line = (await reader.readline()).decode('latin-1').split()
+        # Skip the headers
+        while (await reader.readline()).strip():
+            pass
+        if len(request_line) != 3 or request_line[0] != 'GET':
+            raise ValueError('Unsupported request')
+        return request_line[1].split('?')[0]
+
+    @staticmethod
+    def _write_response(writer, status, content_type, body):
+        """Writes a complete HTTP response."""
+
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode())
+        writer.write(body)
+
+    @staticmethod
+    def _encode_event(event, data):
+        """Returns a Server-Sent Event with the given name and JSON data."""
+
+        return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
@@ -7,24 +7,44 @@ loading times."""
 
 import itertools
 import logging
+import multiprocessing
 import os
 import os.path
 import pickle
 import random
 import time
 
+import numpy as np
 from nltk import word_tokenize
 from nltk import pos_tag
+from scipy.sparse import csr_matrix
+from sklearn.feature_selection import chi2, mutual_info_classif
 from unidecode import unidecode
 
+from tokenizer import CachedTokenizer, TweetTokenizer
+
 
 class DataSet:
 
     data_set = None
     feature_list = None
+    feature_index = None
+    # Used to split documents into words when building featuresets. This can be replaced with
+    # any tokenizer.Tokenizer, such as tokenizer.NltkTokenizer()
+    tokenizer = CachedTokenizer(TweetTokenizer())
+    # Number of processes used to tokenize and tag the corpora. 1 does everything in this
+    # process.
+    processes = os.cpu_count() or 1
+    # (method, max_features, min_score) of the feature selection applied to the feature list,
+    # or None to keep every word. Set by ClassifierTrainer
+    feature_selection = None
+    feature_selection_methods = ('chi2', 'mutual_info')
 
     def __init__(self):
-        self.training_set = None
+        # Sparse matrix with a row for each document and a column for each word in
+        # all_features, in the same order as get_feature_index
+        self.training_matrix = None
+        self.training_labels = None
         self.all_features = None
 
     @staticmethod
@@ -36,17 +56,36 @@ class DataSet:
             DataSet._load_feature_list()
         return DataSet.feature_list
 
+    @staticmethod
+    def get_feature_index():
+        """Returns a dict that maps each word in the feature list to its column in a feature
+        vector. Columns are assigned in sorted word order, which is the same order the
+        DictVectorizer inside each trained classifier uses. If the index is not built, it will
+        build it."""
+
+        if DataSet.feature_index is None:
+            DataSet.feature_index = {word: column for column, word
+                                     in enumerate(sorted(set(DataSet.get_feature_list())))}
+        return DataSet.feature_index
+
     @staticmethod
     def _load_feature_list():
         """This method will load the raw corpora data to construct a word list used for
         building featuresets. It will not build full featuresets from the corpora, and so is
-        more memory efficient for classification with pre-trained classifiers."""
+        more memory efficient for classification with pre-trained classifiers. If a feature
+        selection is set and its feature list has not been pickled, the full data set is loaded
+        instead, since the words are selected by how they score on the training data."""
 
         # Try to load the feature list from pickle
-        pickle_filepath = os.path.join('pickles', 'features.pickle')
+        pickle_filepath = DataSet._get_feature_list_filepath()
         DataSet.feature_list = DataSet._load_data_from_pickle(pickle_filepath)
 
-        if DataSet.feature_list is None:
+        if DataSet.feature_list is None and DataSet.feature_selection is not None:
+
+            # Selecting features needs the whole training matrix, which training will need too
+            DataSet.get_data()
+
+        elif DataSet.feature_list is None:
 
             # documents will be a list of tuples consisting of text and its sentiment
             documents = []
@@ -95,25 +134,120 @@ class DataSet:
 
         # Build list of all words that appear in data set
         word_list = DataSet._build_feature_list(documents)
+        DataSet.feature_list = word_list
+        DataSet.feature_index = None
 
-        # Build list of labeled features
-        labeled_features = DataSet._build_labeled_featuresets(documents, word_list)
-
-        # Shuffle the featuresets
-        random.shuffle(labeled_features)
+        # Shuffle the documents
+        random.shuffle(documents)
 
         # Create the DataSet object and store the data in it
         data = DataSet()
-        data.training_set = labeled_features
+        data.training_matrix = DataSet._build_training_matrix(documents,
+                                                              DataSet.get_feature_index())
+        data.training_labels = np.array([sentiment for _, sentiment in documents])
+
+        # Keep only the most informative words, if a feature selection is set
+        if DataSet.feature_selection is not None:
+            data.training_matrix, word_list = DataSet._select_features(
+                data.training_matrix, data.training_labels, DataSet.get_feature_index(),
+                *DataSet.feature_selection)
+            DataSet.feature_list = word_list
+            DataSet.feature_index = None
         data.all_features = word_list
-        DataSet.feature_list = word_list
 
         # Pickle the data set to reduce future loading times
-        DataSet._save_data_to_pickle(os.path.join('pickles', 'features.pickle'), word_list)
+        DataSet._save_data_to_pickle(DataSet._get_feature_list_filepath(), word_list)
 
         logging.debug(f"Data loading complete. Time taken: {time.time()-start_time}\n")
         return data
 
+    @staticmethod
+    def set_feature_selection(selection):
+        """Sets the feature selection applied to the feature list. selection is a tuple of the
+        method ('chi2' or 'mutual_info'), the largest number of words to keep and the lowest
+        score a word can have to be kept (either may be None), or None to keep every word. If
+        it has changed, the loaded feature list and data set are forgotten so that they are
+        loaded again with the new selection. Returns whether it changed."""
+
+        if selection == DataSet.feature_selection:
+            return False
+        if selection is not None and selection[0] not in DataSet.feature_selection_methods:
+            raise ValueError(f"Unknown feature selection method {selection[0]!r}, expected "
+                             f"one of {', '.join(DataSet.feature_selection_methods)}")
+
+        DataSet.feature_selection = selection
+        DataSet.feature_list = None
+        DataSet.feature_index = None
+        DataSet.data_set = None
+        return True
+
+    @staticmethod
+    def get_feature_selection_name():
+        """Returns a short name for the feature selection, such as 'chi2-top2000', for naming
+        the files that depend on it. Returns None if every word is kept."""
+
+        if DataSet.feature_selection is None:
+            return None
+        method, max_features, min_score = DataSet.feature_selection
+        name = method
+        if max_features is not None:
+            name += f'-top{max_features}'
+        if min_score is not None:
+            name += f'-min{min_score:g}'
+        return name
+
+    @staticmethod
+    def _get_feature_list_filepath():
+        """Returns the path of the feature list pickle for the current feature selection."""
+
+        selection_name = DataSet.get_feature_selection_name()
+        if selection_name is None:
+            return os.path.join('pickles', 'features.pickle')
+        return os.path.join('pickles', f'features-{selection_name}.pickle')
+
+    @staticmethod
+    def _select_features(training_matrix, training_labels, feature_index, method,
+                         max_features=None, min_score=None):
+        """Scores every column of training_matrix against training_labels with method, and
+        keeps the max_features best columns, or the ones scoring at least min_score, or both.
+        Returns the matrix of the kept columns and the list of their words, in column order."""
+
+        start = time.time()
+        scores = DataSet._score_features(training_matrix, training_labels, method)
+        columns = DataSet._choose_features(scores, max_features, min_score)
+        words = sorted(feature_index, key=feature_index.get)
+        logging.debug(f"Selected {len(columns)} of {len(words)} features with {method}. "
+                      f"Time taken: {time.time()-start}")
+        return training_matrix[:, columns], [words[column] for column in columns]
+
+    @staticmethod
+    def _score_features(training_matrix, training_labels, method):
+        """Returns an array of how much each column of training_matrix tells about
+        training_labels. 'chi2' scores each word with the chi-squared statistic of its counts
+        in each class, which is fast. 'mutual_info' scores it with the mutual information
+        between the word being present and the label, which is slower. Words that never
+        appear score 0."""
+
+        if method == 'chi2':
+            scores, _ = chi2(training_matrix, training_labels)
+        else:
+            scores = mutual_info_classif(training_matrix, training_labels,
+                                         discrete_features=True)
+        return np.nan_to_num(scores)
+
+    @staticmethod
+    def _choose_features(scores, max_features=None, min_score=None):
+        """Returns the sorted columns of the max_features highest scores, or of the scores of
+        at least min_score, or both. Ties are broken by column order."""
+
+        columns = np.arange(len(scores))
+        if min_score is not None:
+            columns = columns[scores >= min_score]
+        if max_features is not None and len(columns) > max_features:
+            best = np.argsort(-scores[columns], kind='mergesort')[:max_features]
+            columns = np.sort(columns[best])
+        return columns
+
     @staticmethod
     def _load_movie_reviews(documents):
         """Loads reviews from the short movie review corpus. Creates tuples of
@@ -133,17 +267,64 @@ class DataSet:
         in documents."""
 
         logging.debug("Building word list")
-        all_words = [word_tokenize(document) for document, _ in documents]
+        start = time.time()
+        all_words = DataSet._map_chunks(DataSet._tokenize_documents,
+                                        [document for document, _ in documents])
         all_words = list({word.lower() for word in itertools.chain.from_iterable(all_words)
                          if len(word) > 2})
+        logging.debug(f"Tokenizing complete. Time taken: {time.time()-start}")
 
         # Remove useless words from word list by part of speech
         # For a list of nltk parts of speech, run nltk.help.upenn_tagset()
+        start = time.time()
         allowed_pos = {'FW', 'JJ', 'JJR', 'JJS', 'MD', 'RB', 'RBR', 'RBS', 'UH',
                        'VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ'}
-        tagged_words = pos_tag(all_words)
+        tagged_words = DataSet._map_chunks(pos_tag, all_words)
+        logging.debug(f"Tagging complete. Time taken: {time.time()-start}")
         return [word[0] for word in tagged_words if word[1] in allowed_pos]
 
+    @staticmethod
+    def _tokenize_documents(documents):
+        """Returns a list of the words in each document, using NLTK's word_tokenize. The feature
+        list is always built with word_tokenize so that it matches the pre-trained
+        classifiers."""
+
+        return [word_tokenize(document) for document in documents]
+
+    @staticmethod
+    def _get_words_of_documents(documents):
+        """Returns a list of the set of lowercase words in each document."""
+
+        return [DataSet._get_document_words(document) for document in documents]
+
+    @staticmethod
+    def _map_chunks(function, items, ordered_chunks=False):
+        """Splits items into chunks and returns the concatenated results of calling function on
+        each chunk. The chunks are handled by a pool of DataSet.processes processes. If
+        ordered_chunks is True, returns an iterator over the result of each chunk instead, in
+        order, so that they can be used while later chunks are still being worked on."""
+
+        if DataSet.processes <= 1 or len(items) < DataSet.processes:
+            results = [function(items)]
+        else:
+            # Several chunks per process keeps every process busy until the end
+            chunk_size = -(-len(items) // (DataSet.processes * 4))
+            chunks = [items[start:start + chunk_size]
+                      for start in range(0, len(items), chunk_size)]
+            results = DataSet._imap_pool(function, chunks)
+
+        if ordered_chunks:
+            return results
+        return list(itertools.chain.from_iterable(results))
+
+    @staticmethod
+    def _imap_pool(function, chunks):
+        """Yields the result of function on each chunk, in order, using a pool of
+        DataSet.processes processes."""
+
+        with multiprocessing.Pool(DataSet.processes) as pool:
+            yield from pool.imap(function, chunks)
+
     @staticmethod
     def _remove_words_by_pos(word_list, allowed_pos):
         """Returns a new list of words from word_list whose part of speech is in
@@ -153,24 +334,91 @@ class DataSet:
         return [word[0] for word in tagged_words if word[1] in allowed_pos]
 
     @staticmethod
-    def _build_labeled_featuresets(documents, word_list):
-        """Returns a list of labeled featuresets. Each labeled featureset is a tuple of a dict
-        (the featureset) and a sentiment (the label). The dict contains word-bool pairs that
-        indicate whether the given word from word_list appears in the corresponding
-        document."""
-
-        logging.debug("Building featureset")
-        return [(DataSet.find_features(document, word_list), sentiment)
-                for document, sentiment in documents]
+    def _build_training_matrix(documents, feature_index):
+        """Returns a sparse matrix with a row for each document, built the same way as
+        find_feature_matrix. The words of each chunk of documents are added to the matrix as
+        soon as they are found, so only the sparse form of the data is ever held in memory."""
+
+        logging.debug("Building training matrix")
+        start = time.time()
+        columns = []
+        row_starts = [0]
+        for document_words in DataSet._map_chunks(DataSet._get_words_of_documents,
+                                                  [document for document, _ in documents],
+                                                  ordered_chunks=True):
+            for words in document_words:
+                columns.extend(sorted(feature_index[word] for word in words
+                                      if word in feature_index))
+                row_starts.append(len(columns))
+
+        matrix = DataSet._make_feature_matrix(columns, row_starts, len(feature_index))
+        logging.debug(f"Training matrix complete. Time taken: {time.time()-start}")
+        return matrix
 
     @staticmethod
     def find_features(document, word_features):
         """Returns a featureset of word-bool pairs. bool will be True if word from
         word_features exists in document, else False."""
 
-        doc_words = set(word.lower() for word in word_tokenize(document))
+        doc_words = DataSet._get_document_words(document)
         return {word: (word in doc_words) for word in word_features}
 
+    @staticmethod
+    def find_feature_vector(document, feature_index):
+        """Returns a featureset as a 1 x len(feature_index) sparse row. The row has a 1 in the
+        column of each word from feature_index that exists in document. Only the words of
+        document are looked up, so the cost depends on the length of document rather than the
+        size of feature_index."""
+
+        return DataSet.find_feature_matrix([document], feature_index)
+
+    @staticmethod
+    def find_feature_matrix(documents, feature_index):
+        """Returns the featuresets of all documents as one sparse matrix with a row per
+        document, built the same way as find_feature_vector. Classifying the whole matrix at
+        once is much faster than classifying the rows one at a time."""
+
+        return DataSet._build_feature_matrix(
+            [DataSet._get_document_words(document) for document in documents], feature_index)
+
+    @staticmethod
+    def featureset_to_vector(featureset, feature_index):
+        """Converts a featureset of word-bool pairs, as returned by find_features, into a sparse
+        row like the ones built by find_feature_vector."""
+
+        words = {word for word, present in featureset.items() if present}
+        return DataSet._build_feature_matrix([words], feature_index)
+
+    @staticmethod
+    def _build_feature_matrix(word_sets, feature_index):
+        """Returns a sparse matrix with a row for each set of words in word_sets. Each row has a
+        1 in the column of every word from feature_index that is in its set."""
+
+        columns = []
+        row_starts = [0]
+        for words in word_sets:
+            columns.extend(sorted(feature_index[word] for word in words
+                                  if word in feature_index))
+            row_starts.append(len(columns))
+
+        return DataSet._make_feature_matrix(columns, row_starts, len(feature_index))
+
+    @staticmethod
+    def _make_feature_matrix(columns, row_starts, width):
+        """Returns a sparse matrix of 1's from the column numbers of every row and the position
+        in columns that each row starts at."""
+
+        # scikit-learn's liblinear models only accept 32-bit sparse indices
+        return csr_matrix((np.ones(len(columns)), np.array(columns, dtype=np.int32),
+                           np.array(row_starts, dtype=np.int32)),
+                          shape=(len(row_starts) - 1, width))
+
+    @staticmethod
+    def _get_document_words(document):
+        """Returns the set of lowercase words in document."""
+
+        return DataSet.tokenizer.get_words(document)
+
     @staticmethod
     def _load_data_from_pickle(pickle_filepath):
         """Attempts to load the data set from a saved pickle file. If the pickle file does not
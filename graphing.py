@@ -1,52 +1,91 @@
 """This module handles the output of the Twitter sentiment analysis. It creates the matplotlib
 graph and word cloud. It also handles processing the data after returned by the classifiers."""
 
+import functools
 import logging
 import matplotlib
 import matplotlib.pyplot as plt
-import random
-import string
+import multiprocessing
 import time
 
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from wordcloud import WordCloud, STOPWORDS
+from metrics import Metrics
+from ordering import ReorderBuffer
+from queueing import drain
+from sentimentwindow import CountWindow, TimeWindow
+from wordcounter import WordCounter, get_stopwords, render_word_cloud
 
 
 WORDCLOUD_UPDATE_INTERVAL = 10
 MAX_TWEETS = 200
 MAX_AVERAGES = 100
+# Seconds between the points of the sentiment graph
+AVERAGE_INTERVAL = 1
+FRAME_RATE = 10
+MAX_DRAIN = 1000
 
 
-def start_graph(queue, keyword):
+def start_graph(queue, keywords, metrics_queue=None, frame_rate=FRAME_RATE, blit=True,
+                window_seconds=None):
     """Creates matplotlib figure and plots, then loops and continuously updates them with the
     data pulled from the Twitter stream. This function must be called in a process separate
-    from the Twitter stream."""
+    from the Twitter stream. Metrics are sent to metrics_queue, if it is given.
 
-    # these are both fixed-size deques that only keep the most recent data
-    recent_tweets, average_sentiments = _init_deques()
+    The graphs are redrawn frame_rate times per second, however fast tweets arrive. Tweets
+    that arrive between frames are collected until the next one. If blit is True and the
+    matplotlib backend supports it, only the sentiment line is redrawn each frame, and only the
+    word cloud when it changes, see SentimentGraph and WordCloudRenderer.
 
-    sentiment_graph, word_cloud = _init_graphs()
-    word_cloud_generator = _get_word_cloud_generator()
+    The graph has a line for each keyword in the list keywords. Every AVERAGE_INTERVAL
+    seconds, the average sentiment of each keyword's tweets from the last window_seconds
+    seconds is added to its line. If window_seconds is None, the last MAX_TWEETS tweets of
+    each keyword are averaged instead. The word cloud is of the tweets of every keyword."""
 
+    Metrics.connect(metrics_queue)
+
+    average_sentiments = {keyword: _init_averages() for keyword in keywords}
+    reorder_buffer = ReorderBuffer()
+    sentiment_windows = {keyword: TimeWindow(window_seconds) if window_seconds
+                         else CountWindow(MAX_TWEETS) for keyword in keywords}
+    word_counter = WordCounter(MAX_TWEETS, get_stopwords())
+
+    sentiment_axes, word_cloud_axes = _init_graphs()
+    sentiment_graph = SentimentGraph(sentiment_axes, keywords, blit)
+    word_cloud = WordCloudRenderer(word_cloud_axes, blit)
+
+    frame_interval = 1 / frame_rate
+    next_frame_time = next_average_time = time.time()
     while plt.fignum_exists(1):
-        _get_tweets(queue, recent_tweets)
-        _get_average_sentiment(recent_tweets, average_sentiments)
-        _update_sentiment_graph(sentiment_graph, average_sentiments, keyword)
-        _update_word_cloud(word_cloud, word_cloud_generator, recent_tweets)
+        _get_tweets(queue, reorder_buffer, sentiment_windows, word_counter,
+                    next_frame_time - time.time())
+        if time.time() < next_frame_time:
+            continue
+        # If a frame ran late, start counting again from now rather than rushing to catch up
+        next_frame_time = max(next_frame_time + frame_interval, time.time())
+
+        frame_start = time.perf_counter()
+        if time.time() >= next_average_time:
+            next_average_time = max(next_average_time + AVERAGE_INTERVAL, time.time())
+            for keyword, sentiment_window in sentiment_windows.items():
+                _get_average_sentiment(sentiment_window, average_sentiments[keyword])
+        sentiment_graph.update(average_sentiments,
+                               {keyword: sentiment_window.get_rate()
+                                for keyword, sentiment_window in sentiment_windows.items()})
+        _update_word_cloud(word_cloud, word_counter)
+        word_cloud.show_finished()
+        # Handles window events, and draws the whole figure if anything asked for it
+        sentiment_graph.canvas.flush_events()
+        Metrics.observe('graph_frame_seconds', time.perf_counter() - frame_start)
 
+    word_cloud.close()
 
-def _init_deques():
-    """Initializes the tweet deque and averages deque with placeholder values. Returns them."""
 
-    # Fill the tweet deque half-and-half with pos and neg
-    temp_data = [('', 'pos', 0.5)]*(MAX_TWEETS//2) + [('', 'neg', 0.5)]*(MAX_TWEETS//2)
-    random.shuffle(temp_data)
-    tweets = deque(temp_data, maxlen=MAX_TWEETS)
-    # Fill the averages deque with 0.5's
-    averages = deque([0.5]*MAX_AVERAGES, maxlen=MAX_AVERAGES)
+def _init_averages():
+    """Returns a fixed-size deque for the most recent averages, filled with 0.5's."""
 
-    return tweets, averages
+    return deque([0.5]*MAX_AVERAGES, maxlen=MAX_AVERAGES)
 
 
 def timer(interval):
@@ -56,6 +95,7 @@ def timer(interval):
     def decorator(func):
         last_time = time.time() - 5
 
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             nonlocal last_time
             if time.time()-last_time > interval:
@@ -78,100 +118,185 @@ def _init_graphs():
     bot = fig.add_subplot(212)
     bot.axis('off')
     plt.ion()
+    plt.show(block=False)
 
     return top, bot
 
 
-def _get_tweets(queue, recent_tweets):
-    """Pulls all of the tweets from the queue and appends them to recent_tweets."""
-
-    while not queue.empty():
-        recent_tweets.append(queue.get())
-
-
-def _get_average_sentiment(recent_tweets, recent_averages):
-    """Calculates the average sentiment from the tweets in recent_tweets. Appends the average
-    to recent_averages."""
-
-    recent_sentiments = [tweet for tweet in recent_tweets]
-    if len(recent_sentiments) > 0:
-        # tweet[1] is the sentiment of the tweet, pos or neg
-        # tweet[2] is the confidence score for the classification, 0..1
-        pos_weight = sum([tweet[2] for tweet in recent_tweets if tweet[1] == 'pos'])
-        neg_weight = sum([tweet[2] for tweet in recent_tweets if tweet[1] == 'neg'])
-        average = pos_weight / (pos_weight + neg_weight)
-        recent_averages.append(average)
-
-
-def _update_sentiment_graph(sentiment_graph, averages, keyword):
-    """Redraws sentiment_graph with data from averages."""
-
-    sentiment_graph.clear()
-
-    line, = sentiment_graph.plot([average for average in averages])
-
-    line.set_linewidth(2)
-    line.set_color('green')
-
-    sentiment_graph.axis([0, MAX_AVERAGES, 0, 1])
-    sentiment_graph.set_title(f'Sentiment for Keyword: {keyword}', fontdict={'fontsize': 25})
-    sentiment_graph.set_ylabel('Positivity', fontdict={'fontsize': 20})
-    sentiment_graph.set_yticks([x*0.25 for x in range(5)])
-    sentiment_graph.set_yticklabels([f'{x}%' for x in range(0, 101, 25)])
-    sentiment_graph.set_xticks([])
-    sentiment_graph.grid(axis='y', alpha=0.4, linestyle='--')
-    sentiment_graph.spines['right'].set_visible(False)
-    sentiment_graph.spines['top'].set_visible(False)
-
-    plt.pause(0.1)
+def _get_tweets(queue, reorder_buffer, sentiment_windows, word_counter, timeout):
+    """Waits up to timeout seconds for numbered tweets from the queue, then pulls all of the
+    ones that are waiting and adds them to word_counter, and to the window in the dict
+    sentiment_windows of each keyword they belong to, in the order they arrived from the
+    stream, using reorder_buffer."""
+
+    for numbered_tweet in drain(queue, max(timeout, 0), MAX_DRAIN):
+        for tweet in reorder_buffer.add(*numbered_tweet):
+            word_counter.add(tweet[0])
+            # tweet[1] is the sentiment of the tweet, pos or neg
+            # tweet[2] is the confidence score for the classification, 0..1
+            # tweet[3] is the keywords the tweet belongs to
+            # tweet[4] is True if the confidence is only a lower bound, see --cascade
+            for keyword in tweet[3]:
+                sentiment_windows[keyword].add(tweet[1], tweet[2])
+
+
+def _get_average_sentiment(sentiment_window, recent_averages):
+    """Appends the average sentiment of the tweets in sentiment_window to recent_averages. If
+    there are no tweets in the window, NaN is appended, which leaves a gap in the graph."""
+
+    positivity = sentiment_window.get_positivity()
+    recent_averages.append(float('nan') if positivity is None else positivity)
+
+
+class SentimentGraph:
+    """The running-average sentiment graph, with a line for each keyword. The axes, title,
+    ticks, grid and legend are drawn once, and after that only the data of the lines changes.
+    With blitting, each frame restores a saved image of the empty axes and draws just the lines
+    over it, instead of laying out and drawing the whole figure. The saved image is taken again
+    whenever the whole figure is drawn, such as when the window is resized or the word cloud
+    changes."""
+
+    def __init__(self, axes, keywords, blit=True):
+        self.axes = axes
+        self.canvas = axes.figure.canvas
+        self.blit = blit and self.canvas.supports_blit
+        self.background = None
+
+        axes.axis([0, MAX_AVERAGES, 0, 1])
+        title = 'Keyword' if len(keywords) == 1 else 'Keywords'
+        axes.set_title(f'Sentiment for {title}: {", ".join(keywords)}',
+                       fontdict={'fontsize': 25})
+        axes.set_ylabel('Positivity', fontdict={'fontsize': 20})
+        axes.set_yticks([x*0.25 for x in range(5)])
+        axes.set_yticklabels([f'{x}%' for x in range(0, 101, 25)])
+        axes.set_xticks([])
+        axes.set_xlabel(f'Last {MAX_AVERAGES * AVERAGE_INTERVAL} seconds')
+        axes.grid(axis='y', alpha=0.4, linestyle='--')
+        axes.spines['right'].set_visible(False)
+        axes.spines['top'].set_visible(False)
+
+        # Animated lines are left out when the whole figure is drawn, so they are not saved in
+        # the background. A single keyword keeps the original green line
+        self.lines = {}
+        for keyword in keywords:
+            self.lines[keyword], = axes.plot(range(MAX_AVERAGES), [0.5]*MAX_AVERAGES,
+                                             linewidth=2, label=keyword,
+                                             color='green' if len(keywords) == 1 else None,
+                                             animated=self.blit)
+        if len(keywords) > 1:
+            axes.legend(loc='upper left')
+        self.rate_text = axes.text(0.99, 0.02, '', transform=axes.transAxes,
+                                   horizontalalignment='right', animated=self.blit)
+
+        if self.blit:
+            self.canvas.mpl_connect('draw_event', self._save_background)
+        self.canvas.draw()
+
+    def update(self, averages, rates):
+        """Shows the averages of each keyword in the dict averages, which must each have
+        MAX_AVERAGES values, and the rates of tweets per second of each keyword in the dict
+        rates."""
+
+        for keyword, line in self.lines.items():
+            line.set_ydata(averages[keyword])
+        if len(rates) == 1:
+            self.rate_text.set_text(f'{sum(rates.values()):.1f} tweets/s')
+        else:
+            self.rate_text.set_text(', '.join(f'{keyword}: {rate:.1f} tweets/s'
+                                              for keyword, rate in rates.items()))
+        if self.blit and self.background is not None:
+            self.canvas.restore_region(self.background)
+            self._draw_animated()
+            self.canvas.blit(self.axes.bbox)
+        else:
+            self.canvas.draw_idle()
+
+    def _save_background(self, event):
+        """Saves the image of the axes after the whole figure has been drawn, then draws the
+        lines and rates over it."""
+
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        """Draws the lines and rates, which are left out when the whole figure is drawn."""
+
+        for line in self.lines.values():
+            self.axes.draw_artist(line)
+        self.axes.draw_artist(self.rate_text)
 
 
 @timer(WORDCLOUD_UPDATE_INTERVAL)
-def _update_word_cloud(word_cloud_plot, word_cloud_generator, recent_tweets):
-    """Updates word_cloud_plot using word_cloud_generator with text data from recent_tweets."""
-
-    text = _get_text_from_tweets(recent_tweets)
-
-    if text.strip():
-        word_cloud = _get_word_cloud(text, word_cloud_generator)
-        word_cloud_plot.clear()
-        word_cloud_plot.imshow(word_cloud, interpolation='bilinear')
-        word_cloud_plot.axis('off')
-
-
-def _get_text_from_tweets(recent_tweets):
-    """Concatenates all tweets in recent_tweets and returns the full text."""
-
-    return ' '.join([tweet[0] for tweet in recent_tweets])
-
-
-def _get_word_cloud(text, generator):
-    """Uses generator to create a word cloud from text. Returns the word cloud."""
-
-    return generator.generate(text)
-
-
-def _get_word_cloud_generator():
-    """Returns a word cloud generator."""
-
-    stopwords = _get_stopwords()
-    return WordCloud(background_color='white', stopwords=stopwords, height=400, width=1000,
-                     min_font_size=9, prefer_horizontal=.8)
-
-
-def _get_stopwords():
-    """Returns a set of stopwords that should be ignored in the word cloud."""
-
-    stopwords = list(STOPWORDS)
-
-    for word in ('http', 'https', 'amp'):
-        stopwords.append(word)
-
-    # Add 1 and 2 letter permutations. This helps exclude common foreign words, shortened
-    # url's, and so forth
-    for c1 in string.ascii_lowercase:
-        stopwords.append(c1)
-        for c2 in string.ascii_lowercase:
-            stopwords.append(c1 + c2)
-
-    return set(stopwords)
+def _update_word_cloud(word_cloud, word_counter):
+    """Starts laying out a new word cloud of the words counted by word_counter."""
+
+    frequencies = word_counter.get_frequencies()
+    if frequencies:
+        word_cloud.render(frequencies)
+
+
+class WordCloudRenderer:
+    """Shows word clouds in axes. Word clouds are laid out in a separate process, since a layout
+    takes long enough to stall the graphs. Each layout is shown once it has finished. With
+    blitting, only the word cloud's axes are redrawn."""
+
+    def __init__(self, axes, blit=True):
+        self.axes = axes
+        self.canvas = axes.figure.canvas
+        self.blit = blit and self.canvas.supports_blit
+        self.image = None
+        # Spawned rather than forked, since forking a process with a GUI is not safe
+        self.executor = ProcessPoolExecutor(max_workers=1,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        self.layout = None
+        self.render_stall = 0.0
+
+    def render(self, frequencies):
+        """Starts laying out a word cloud of the words in the dict frequencies. Does nothing if
+        the previous layout has not finished yet."""
+
+        if self.layout is not None:
+            logging.debug("Skipping word cloud update, the last one has not finished")
+            return
+        start = time.perf_counter()
+        self.layout = self.executor.submit(render_word_cloud, frequencies)
+        self.render_stall = time.perf_counter() - start
+
+    def show_finished(self):
+        """Shows the word cloud that was being laid out, if it has finished."""
+
+        if self.layout is None or not self.layout.done():
+            return
+        start = time.perf_counter()
+        try:
+            image, layout_time = self.layout.result()
+        except Exception as e:
+            logging.error(f"Word cloud layout failed: {e}")
+            self.layout = None
+            return
+        self.layout = None
+
+        if self.image is None:
+            self.image = self.axes.imshow(image, interpolation='bilinear')
+            self.axes.axis('off')
+            self.canvas.draw_idle()
+        else:
+            self.image.set_data(image)
+            if self.blit:
+                self.axes.draw_artist(self.image)
+                self.canvas.blit(self.axes.bbox)
+            else:
+                self.canvas.draw_idle()
+
+        stall = self.render_stall + time.perf_counter() - start
+        logging.debug(f"Word cloud updated. Layout took {layout_time:.3f}s in the background, "
+                      f"the graphs stalled for {stall:.3f}s")
+
+    def close(self):
+        """Stops the word cloud process. A layout that has not started yet is cancelled rather
+        than waited for."""
+
+        if self.layout is not None:
+            self.layout.cancel()
+            self.layout = None
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,48 @@
+"""This module finds which of the tracked keywords a tweet contains, so that one stream and one
+set of classifiers can serve many keywords at once. All of the keywords are compiled into a
+single regex, so a tweet is searched once however many keywords are tracked, instead of once
+for each keyword."""
+
+import re
+
+
+def parse_keywords(text):
+    """Returns a list of the comma separated keywords in text, without duplicates."""
+
+    keywords = []
+    for keyword in text.split(','):
+        keyword = ' '.join(keyword.split())
+        if keyword and keyword.lower() not in (k.lower() for k in keywords):
+            keywords.append(keyword)
+    return keywords
+
+
+class KeywordMatcher:
+    """Matches tweets against a list of keywords. Like Twitter's filter, keywords are matched
+    without regard to case, as whole words, and also inside hashtags and mentions, so
+    "apple" matches "Apple's" and "#apple" but not "pineapple"."""
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # Longer keywords are tried first, so a phrase is matched rather than its first word
+        alternatives = sorted({keyword.lower() for keyword in self.keywords}, key=len,
+                              reverse=True)
+        self.pattern = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(keyword)
+                                                           for keyword in alternatives) +
+                                  r')(?!\w)', re.IGNORECASE)
+
+    def find(self, text):
+        """Returns a tuple of the keywords that appear in text, in the order they were
+        given."""
+
+        found = {match.lower() for match in self.pattern.findall(text)}
+        return tuple(keyword for keyword in self.keywords if keyword.lower() in found)
+
+    def tag(self, text):
+        """Returns a tuple of the keywords that a tweet from the stream belongs to. This is the
+        keywords in its text. If only one keyword is tracked, every tweet belongs to it, since
+        Twitter also matches keywords in links and user names that are not in the text."""
+
+        if len(self.keywords) == 1:
+            return tuple(self.keywords)
+        return self.find(text)
@@ -0,0 +1,41 @@
+"""This class scores several linear models with a single matrix product. Five of the models in
+the VotingClassifier (both naive Bayes models, logistic regression, SGD and the linear SVM)
+are linear in the same features, so their weights can be stacked into one matrix. Multiplying
+the features by that matrix scores every class of every model at once, instead of making a
+separate pass over the features for each model."""
+
+import numpy as np
+
+
+class LinearEnsemble:
+
+    def __init__(self, linear_models):
+        if not linear_models:
+            raise ValueError("A LinearEnsemble needs at least one linear model")
+        self.models = linear_models
+
+        # Each model owns a run of columns in the stacked weights, one for each of its rows
+        self.column_ranges = []
+        column = 0
+        for model in linear_models:
+            self.column_ranges.append((column, column + model.weights.shape[0]))
+            column += model.weights.shape[0]
+
+        # Stored with a row per feature so that each nonzero feature adds one contiguous row
+        self.weights = np.ascontiguousarray(np.vstack([model.weights
+                                                       for model in linear_models]).T)
+        self.bias = np.concatenate([model.bias for model in linear_models])
+
+    def predict(self, feature_matrix):
+        """Returns a list with an array of predicted labels from each model, in the same order
+        as the models. Each array has one label for each row of feature_matrix."""
+
+        scores = feature_matrix @ self.weights + self.bias
+
+        predictions = []
+        for model, (start, end) in zip(self.models, self.column_ranges):
+            if end - start == 1:
+                predictions.append(model.labels[(scores[:, start] > 0).astype(int)])
+            else:
+                predictions.append(model.labels[scores[:, start:end].argmax(axis=1)])
+        return predictions
@@ -1,47 +1,251 @@
+import argparse
 import logging
 import multiprocessing
+import multiprocessing.forkserver
 
-from classification import start_classify
-from graphing import start_graph
-from streaming import start_stream
+from keywords import parse_keywords
+from metrics import MetricsServer
+from sources import RATE_MODES, get_source
+from storage import start_storage
 
 logging.basicConfig(level=logging.DEBUG,
                     format=' %(asctime)s - %(levelname)s - %(funcName)-30s - %(message)s')
 # logging.disable(logging.CRITICAL)
 
+# Seconds a process is given to stop by itself when the program closes, before it is terminated
+SHUTDOWN_TIMEOUT = 10
+
 
 def main():
 
-    print('This program takes a keyword, then pulls tweets that contain that keyword from '
-          'Twitter, passes them through a battery of machine learning classifiers to tag them '
-          'as either positive or negative, then graphs the results. The results are in the '
-          'form of a running-average graph and a word cloud of the most common words in the '
-          'most recent tweets.')
+    args = _parse_args()
 
-    keyword = input('What keyword do you want to analyze? ').strip()
+    # The models are loaded while the keywords are being typed in
+    worker_context = multiprocessing
+    if args.warm_start:
+        worker_context = _start_forkserver()
+    elif multiprocessing.get_start_method() == 'fork':
+        # Forked processes inherit the loaded models, so every classification process shares
+        # them instead of loading its own copy
+        import preload
 
-    stream_to_classify = multiprocessing.Queue()
-    classify_to_graph = multiprocessing.Queue()
+    print('This program takes one or more keywords, then pulls tweets that contain those '
+          'keywords from Twitter, passes them through a battery of machine learning '
+          'classifiers to tag them as either positive or negative, then graphs the results. '
+          'The results are in the form of a running-average graph for each keyword and a '
+          'word cloud of the most common words in the most recent tweets.')
 
-    streaming_process = multiprocessing.Process(target=start_stream,
-                                                args=(keyword, stream_to_classify))
+    keywords = []
+    while not keywords:
+        keywords = parse_keywords(input('What keywords do you want to analyze? Separate '
+                                        'them with commas: '))
 
-    classification_process = multiprocessing.Process(target=start_classify,
-                                                     args=(stream_to_classify,
-                                                           classify_to_graph))
+    if args.transport == 'shm':
+        # Shared memory needs Python 3.8, so it is only imported when it is used
+        from ringbuffer import ResultRing, TweetRing
+        stream_to_classify = TweetRing(keywords)
+        classify_to_graph = ResultRing(keywords)
+    else:
+        stream_to_classify = multiprocessing.Queue()
+        classify_to_graph = multiprocessing.Queue()
+    classify_to_store = multiprocessing.Queue() if args.store else None
 
-    graphing_process = multiprocessing.Process(target=start_graph,
-                                               args=(classify_to_graph, keyword))
+    metrics_queue = None
+    if args.metrics_port:
+        metrics_queue = multiprocessing.Queue()
+        queues = {'stream_to_classify': stream_to_classify,
+                  'classify_to_graph': classify_to_graph}
+        if classify_to_store is not None:
+            queues['classify_to_store'] = classify_to_store
+        MetricsServer(metrics_queue, queues, args.metrics_port).start()
 
+    source = get_source(args.replay, args.rate, args.rate_mode)
+    streaming_process = multiprocessing.Process(target=source,
+                                                args=(keywords, stream_to_classify),
+                                                kwargs={'metrics_queue': metrics_queue})
     streaming_process.start()
-    classification_process.start()
+
+    stop_classifying = worker_context.Event()
+    classify_kwargs = {'near_duplicates': args.near_duplicates, 'cascade': args.cascade,
+                       'metrics_queue': metrics_queue, 'storage_queue': classify_to_store,
+                       'stop_event': stop_classifying}
+    classification_processes = [worker_context.Process(target=_start_classify,
+                                                       args=(stream_to_classify,
+                                                             classify_to_graph),
+                                                       kwargs=classify_kwargs)
+                                for _ in range(args.workers)]
+    for classification_process in classification_processes:
+        classification_process.start()
+
+    storage_process = None
+    if classify_to_store is not None:
+        storage_process = multiprocessing.Process(target=start_storage,
+                                                  args=(classify_to_store, args.store),
+                                                  kwargs={'metrics_queue': metrics_queue})
+        storage_process.start()
+
+    updater_process = None
+    if args.labels:
+        stop_updating = multiprocessing.Event()
+        updater_process = multiprocessing.Process(target=_start_updater,
+                                                  args=(args.labels, stop_updating),
+                                                  kwargs={'metrics_queue': metrics_queue})
+        updater_process.start()
+
+    # The graphs are imported here rather than at the top of the file, since a spawned process
+    # imports this file again, and only the graphing process needs matplotlib. By now the
+    # other processes are already running
+    if args.headless:
+        from dashboard import start_dashboard
+        graphing_process = multiprocessing.Process(target=start_dashboard,
+                                                   args=(classify_to_graph, keywords),
+                                                   kwargs={'metrics_queue': metrics_queue,
+                                                           'host': args.host,
+                                                           'port': args.port,
+                                                           'window_seconds': args.window})
+    else:
+        from graphing import start_graph
+        graphing_process = multiprocessing.Process(target=start_graph,
+                                                   args=(classify_to_graph, keywords),
+                                                   kwargs={'metrics_queue': metrics_queue,
+                                                           'frame_rate': args.frame_rate,
+                                                           'blit': not args.no_blit,
+                                                           'window_seconds': args.window})
     graphing_process.start()
 
     graphing_process.join()
     streaming_process.terminate()
-    classification_process.terminate()
     streaming_process.join()
-    classification_process.join()
+    # The classification processes are stopped between batches rather than terminated, since
+    # a process killed while writing to a queue can leave it locked or holding half a message,
+    # and then the storage process would never receive the None that stops it
+    stop_classifying.set()
+    for classification_process in classification_processes:
+        _stop_process(classification_process)
+    if storage_process is not None:
+        # Let the storage process write the tweets it has been sent before it stops
+        classify_to_store.put(None)
+        _stop_process(storage_process)
+    if updater_process is not None:
+        # Let the updater stop its retraining process, if one is running
+        stop_updating.set()
+        _stop_process(updater_process)
+    if args.transport == 'shm':
+        stream_to_classify.unlink()
+        classify_to_graph.unlink()
+
+
+def _stop_process(process, timeout=SHUTDOWN_TIMEOUT):
+    """Waits up to timeout seconds for process to stop by itself, then terminates it."""
+
+    process.join(timeout)
+    if process.is_alive():
+        logging.error(f"{process.name} did not stop within {timeout} seconds, terminating it")
+        process.terminate()
+        process.join()
+
+
+def _start_classify(*args, **kwargs):
+    """Runs classification.start_classify. The classification module is imported by the
+    classification process itself, so that this process does not have to import scikit-learn
+    and NLTK only to start it. It has already been imported if the process was forked."""
+
+    from classification import start_classify
+    start_classify(*args, **kwargs)
+
+
+def _start_updater(*args, **kwargs):
+    """Runs updater.start_updater, importing the updater module in the updater process for the
+    same reason as _start_classify."""
+
+    from updater import start_updater
+    start_updater(*args, **kwargs)
+
+
+def _start_forkserver():
+    """Starts the forkserver that the classification processes are forked from. It loads the
+    models in the background as it starts, see the preload module. Every other process is
+    spawned, so none of them import the classifiers. Returns the context for starting
+    classification processes."""
+
+    multiprocessing.set_start_method('spawn')
+    multiprocessing.set_forkserver_preload(['preload'])
+    context = multiprocessing.get_context('forkserver')
+    multiprocessing.forkserver.ensure_running()
+    return context
+
+
+def _parse_args():
+    """Returns the parsed command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Live analysis of Twitter sentiment toward '
+                                                 'any given keywords.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of processes used to classify tweets (default: 1)')
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help='reuse the classification of a recent tweet that is almost the '
+                             'same, not just an exact duplicate')
+    parser.add_argument('--cascade', action='store_true',
+                        help='stop classifying each tweet as soon as its majority vote is '
+                             'decided. Faster, but confidences become lower bounds')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='load the models in a forkserver while the keywords are typed '
+                             'in, and fork the classification processes from it, so they '
+                             'start classifying straight away. The other processes are '
+                             'spawned and do not import the classifiers')
+    parser.add_argument('--transport', choices=('queue', 'shm'), default='queue',
+                        help='pass tweets between the processes through multiprocessing '
+                             'queues, or through ring buffers in shared memory, which copy '
+                             'less but drop tweets when full (default: queue)')
+    parser.add_argument('--frame-rate', type=_positive_float, default=10,
+                        help='number of times per second the graphs are redrawn (default: 10)')
+    parser.add_argument('--no-blit', action='store_true',
+                        help='redraw the whole figure every frame instead of only the '
+                             'sentiment line')
+    parser.add_argument('--window', type=float, metavar='SECONDS',
+                        help='average the sentiment of the tweets from the last SECONDS '
+                             'seconds, instead of the last 200 tweets')
+    parser.add_argument('--headless', action='store_true',
+                        help='serve the graphs as a web page instead of opening a window')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address the --headless web page is served on '
+                             '(default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='port the --headless web page is served on (default: 8080)')
+    parser.add_argument('--metrics-port', type=int, default=8000,
+                        help='serve metrics in the Prometheus format at '
+                             'http://localhost:PORT/metrics, or 0 to turn them off '
+                             '(default: 8000)')
+    parser.add_argument('--store', metavar='FILE', default='tweets.db',
+                        help='save the classified tweets and their per-minute and per-hour '
+                             'totals to the SQLite database FILE (default: tweets.db)')
+    parser.add_argument('--no-store', dest='store', action='store_const', const=None,
+                        help='do not save the classified tweets')
+    parser.add_argument('--labels', metavar='FILE',
+                        help='keep updating the classifiers with the labeled tweets added to '
+                             'FILE while the program runs. Each line is pos or neg, a tab, '
+                             'then the text of a tweet')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='replay the tweets in FILE instead of streaming from Twitter. '
+                             'Each line is a tweet as JSON or as plain text')
+    parser.add_argument('--rate', type=float, default=50,
+                        help='tweets per second sent by --replay (default: 50)')
+    parser.add_argument('--rate-mode', choices=RATE_MODES, default='fixed',
+                        help='send replayed tweets evenly spaced, in bursts, or as fast as '
+                             'possible (default: fixed)')
+    return parser.parse_args()
+
+
+def _positive_float(value):
+    """Returns the command line argument value as a float, if it is greater than 0."""
+
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: {value!r}")
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0: {value!r}")
+    return number
 
 
 if __name__ == '__main__':
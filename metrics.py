@@ -0,0 +1,252 @@
+"""This module collects counters and histograms from every process and serves them in the
+Prometheus text format, so that a program left running unattended can be checked on. Each
+process records its metrics locally with Metrics, which costs no more than a dict update, and
+sends a snapshot of them to the main process about once a second. The main process runs a
+MetricsServer, which keeps the latest snapshot from each process, adds them together and serves
+the totals over HTTP along with the current depth of the queues between the processes:
+
+    curl http://localhost:8000/metrics
+"""
+
+import bisect
+import http.server
+import logging
+import os
+import socketserver
+import threading
+import time
+
+
+PREFIX = 'tsa_'
+PUBLISH_INTERVAL = 1
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (type, help text) of every metric that is published
+METRICS = {
+    'tweets_received_total': ('counter', 'Tweets received from the stream.'),
+    'retweets_filtered_total': ('counter', 'Retweets discarded by the stream listener.'),
+    'tweets_matched_total': ('counter', 'Tweets that belong to each keyword.'),
+    'listener_flushes_total': ('counter', 'Batches of tweets sent on by the stream listener.'),
+    'stream_reconnects_total': ('counter', 'Reconnections to Twitter, by the class of error.'),
+    'stream_backoff_seconds_total': ('counter', 'Time spent waiting to reconnect to Twitter.'),
+    'tweets_classified_total': ('counter', 'Tweets classified, including cached results.'),
+    'tweets_dropped_total': ('counter', 'Tweets dropped because classification fell behind.'),
+    'tweets_stored_total': ('counter', 'Rows written to the database, one per keyword.'),
+    'labeled_tweets_total': ('counter', 'Labeled tweets read by the model updater.'),
+    'model_updates_total': ('counter', 'Model versions saved by the updater, by kind.'),
+    'model_swaps_total': ('counter', 'Times a classification process swapped in new models.'),
+    'classify_seconds': ('histogram', 'Time each model took to classify a batch of tweets.'),
+    'graph_frame_seconds': ('histogram', 'Time taken by each update of the graphs.'),
+    'store_write_seconds': ('histogram', 'Time taken by each write to the database.'),
+    'queue_depth': ('gauge', 'Items waiting in each queue between the processes.'),
+    'queue_overflows_total': ('counter', 'Items dropped by a full shared memory queue.'),
+}
+
+
+class Metrics:
+    """Records the metrics of the current process. Call connect at the start of each process
+    with the queue that its snapshots should be sent to. Until then, metrics are recorded but
+    never sent anywhere."""
+
+    metrics_queue = None
+    # (name, labels) -> count
+    counters = {}
+    # (name, labels) -> [count in each bucket, sum of the values, number of values]
+    histograms = {}
+    last_publish_time = 0.0
+
+    @staticmethod
+    def connect(metrics_queue):
+        """Sends the metrics of this process to metrics_queue from now on. Any metrics that
+        were inherited from a parent process are discarded."""
+
+        Metrics.metrics_queue = metrics_queue
+        Metrics.counters = {}
+        Metrics.histograms = {}
+
+    @staticmethod
+    def increment(name, amount=1, **labels):
+        """Adds amount to the counter with the given name and labels."""
+
+        key = (name, tuple(sorted(labels.items())))
+        Metrics.counters[key] = Metrics.counters.get(key, 0) + amount
+        Metrics.publish()
+
+    @staticmethod
+    def observe(name, value, **labels):
+        """Adds value to the histogram with the given name and labels."""
+
+        key = (name, tuple(sorted(labels.items())))
+        histogram = Metrics.histograms.get(key)
+        if histogram is None:
+            histogram = Metrics.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        bucket = bisect.bisect_left(BUCKETS, value)
+        if bucket < len(BUCKETS):
+            histogram[0][bucket] += 1
+        histogram[1] += value
+        histogram[2] += 1
+        Metrics.publish()
+
+    @staticmethod
+    def publish(force=False):
+        """Sends a snapshot of this process's metrics to the metrics queue, if one is connected
+        and PUBLISH_INTERVAL seconds have passed since the last one was sent."""
+
+        if Metrics.metrics_queue is None:
+            return
+        now = time.time()
+        if not force and now - Metrics.last_publish_time < PUBLISH_INTERVAL:
+            return
+        Metrics.last_publish_time = now
+
+        histograms = {key: [list(histogram[0]), histogram[1], histogram[2]]
+                      for key, histogram in Metrics.histograms.items()}
+        Metrics.metrics_queue.put((os.getpid(), dict(Metrics.counters), histograms))
+
+
+class MetricsServer:
+    """Collects the snapshots sent by every process to metrics_queue and serves their totals
+    at http://host:port/metrics. queues is a dict of the multiprocessing queues whose depths
+    are reported, by name."""
+
+    def __init__(self, metrics_queue, queues, port, host='127.0.0.1'):
+        self.metrics_queue = metrics_queue
+        self.queues = queues
+        self.address = (host, port)
+        # process id -> (counters, histograms)
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts collecting snapshots and serving them, on daemon threads. If the port cannot
+        be used, the error is logged and the program runs without serving metrics. The
+        snapshots are still collected, so that metrics_queue does not fill up."""
+
+        threading.Thread(target=self._collect_snapshots, daemon=True).start()
+        try:
+            server = _ThreadingHTTPServer(self.address, self._get_handler())
+        except OSError as e:
+            logging.error(f"Could not serve metrics on port {self.address[1]}: {e}")
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.debug(f"Serving metrics at http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def render(self):
+        """Returns the metrics of every process, added together, in the Prometheus text
+        format."""
+
+        counters = {}
+        histograms = {}
+        with self.lock:
+            snapshots = list(self.snapshots.values())
+        for process_counters, process_histograms in snapshots:
+            for key, count in process_counters.items():
+                counters[key] = counters.get(key, 0) + count
+            for key, (buckets, total, count) in process_histograms.items():
+                histogram = histograms.setdefault(key, [[0] * len(BUCKETS), 0.0, 0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+
+        gauges = {}
+        for queue_name, depth_queue in self.queues.items():
+            try:
+                gauges[('queue_depth', (('queue', queue_name),))] = depth_queue.qsize()
+            except NotImplementedError:
+                # qsize is not available on macOS
+                pass
+            # Ring buffers count the items that did not fit in them
+            if hasattr(depth_queue, 'overflow_count'):
+                counters[('queue_overflows_total', (('queue', queue_name),))] = \
+                    depth_queue.overflow_count
+
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f'# HELP {PREFIX}{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}{name} {metric_type}')
+            if metric_type == 'histogram':
+                for (_, labels), histogram in sorted(MetricsServer._select(histograms, name)):
+                    lines.extend(MetricsServer._format_histogram(name, labels, histogram))
+            else:
+                samples = MetricsServer._select(counters if metric_type == 'counter'
+                                                else gauges, name)
+                for (_, labels), value in sorted(samples):
+                    lines.append(f'{PREFIX}{name}{MetricsServer._format_labels(labels)} '
+                                 f'{value}')
+        return '\n'.join(lines) + '\n'
+
+    def _collect_snapshots(self):
+        """Keeps the latest snapshot from each process. Runs forever."""
+
+        while True:
+            try:
+                process_id, counters, histograms = self.metrics_queue.get()
+            except (EOFError, OSError):
+                return
+            with self.lock:
+                self.snapshots[process_id] = (counters, histograms)
+
+    def _get_handler(self):
+        """Returns a request handler class that serves render at /metrics."""
+
+        metrics_server = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_server.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
+
+    @staticmethod
+    def _select(samples, name):
+        """Returns the (key, value) pairs of samples that belong to the metric name."""
+
+        return [(key, value) for key, value in samples.items() if key[0] == name]
+
+    @staticmethod
+    def _format_histogram(name, labels, histogram):
+        """Returns the lines of a histogram with cumulative buckets."""
+
+        buckets, total, count = histogram
+        lines = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(BUCKETS, buckets):
+            cumulative += bucket_count
+            bucket_labels = MetricsServer._format_labels(labels + (('le', str(upper_bound)),))
+            lines.append(f'{PREFIX}{name}_bucket{bucket_labels} {cumulative}')
+        bucket_labels = MetricsServer._format_labels(labels + (('le', '+Inf'),))
+        lines.append(f'{PREFIX}{name}_bucket{bucket_labels} {count}')
+        lines.append(f'{PREFIX}{name}_sum{MetricsServer._format_labels(labels)} {total}')
+        lines.append(f'{PREFIX}{name}_count{MetricsServer._format_labels(labels)} {count}')
+        return lines
+
+    @staticmethod
+    def _format_labels(labels):
+        """Returns labels, a tuple of (name, value) pairs, in braces, or an empty string if
+        there are none."""
+
+        if not labels:
+            return ''
+        escaped = [(name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                    .replace('\n', r'\n')) for name, value in labels]
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """An HTTPServer that handles each request on its own daemon thread. The same as
+    http.server.ThreadingHTTPServer, which needs Python 3.7."""
+
+    daemon_threads = True
@@ -0,0 +1,302 @@
+"""This class stores the trained classifiers in one compact file that can be memory-mapped.
+Each pickled SklearnClassifier carries its own DictVectorizer with a full copy of the
+vocabulary, and every process that unpickles them gets a private copy of every array. A bundle
+stores the vocabulary once, followed by the raw parameter arrays of each model. Loading a
+bundle maps the file into memory instead of reading it, so it is fast, and every process that
+loads the same bundle shares the same pages.
+
+The file layout is a fixed preamble (magic bytes, format version and header length), a JSON
+header describing the vocabulary and models, then each array aligned to 64 bytes."""
+
+import json
+import logging
+import os
+import os.path
+import struct
+import tempfile
+
+import numpy as np
+from scipy.special import expit
+
+
+class ModelBundle:
+
+    MAGIC = b'TSAMODEL'
+    VERSION = 1
+    PREAMBLE = struct.Struct('<8sIQ')
+    ALIGNMENT = 64
+
+    def __init__(self, vocabulary, models, sources=None):
+        self.vocabulary = vocabulary
+        self.models = models
+        # Describes the files the models were exported from, see export
+        self.sources = sources
+
+    def get_feature_index(self):
+        """Returns a dict that maps each word in the vocabulary to its column."""
+
+        return {word: column for column, word in enumerate(self.vocabulary)}
+
+    def get_names(self):
+        """Returns the names of the models, in order."""
+
+        return [model.name for model in self.models]
+
+    @staticmethod
+    def export(filepath, names, classifiers, sources=None):
+        """Writes the trained SklearnClassifiers in classifiers to a bundle at filepath. names
+        is a list of the classifier names, in the same order. All of the classifiers must have
+        been trained on the same features. sources can be any JSON-serializable description of
+        the files the classifiers came from. It is stored in the bundle so that whoever loads
+        it can tell whether those files have changed since."""
+
+        logging.debug(f"Writing model bundle to {filepath}")
+        vocabulary = list(classifiers[0]._vectorizer.feature_names_)
+
+        header = {'vocabulary': vocabulary, 'models': [], 'sources': sources}
+        arrays = []
+        for name, classifier in zip(names, classifiers):
+            if list(classifier._vectorizer.feature_names_) != vocabulary:
+                raise ValueError(f"{name} was trained on different features than "
+                                 f"{names[0]}")
+            labels = classifier._encoder.classes_[classifier._clf.classes_]
+            kind, params, model_arrays = ModelBundle._get_model_parameters(classifier._clf)
+            header['models'].append({'name': name, 'kind': kind, 'labels': labels.tolist(),
+                                     'params': params,
+                                     'arrays': ModelBundle._add_arrays(arrays, model_arrays)})
+
+        ModelBundle._write_file(filepath, header, arrays)
+
+    @staticmethod
+    def load(filepath):
+        """Memory-maps the bundle at filepath and returns a ModelBundle. Returns None if the
+        file does not exist or was written by a different version of this class."""
+
+        if not os.path.isfile(filepath):
+            return None
+
+        logging.debug(f"Loading model bundle from {filepath}")
+        data = np.memmap(filepath, dtype=np.uint8, mode='r')
+        magic, version, header_length = ModelBundle.PREAMBLE.unpack_from(data)
+        if magic != ModelBundle.MAGIC or version != ModelBundle.VERSION:
+            logging.debug("Model bundle is an unsupported version")
+            return None
+
+        header_start = ModelBundle.PREAMBLE.size
+        header = json.loads(bytes(data[header_start:header_start + header_length]).decode())
+        data_start = ModelBundle._align(header_start + header_length)
+
+        models = []
+        for model in header['models']:
+            arrays = {name: ModelBundle._get_array(data, data_start + offset, dtype, shape)
+                      for name, (offset, dtype, shape) in model['arrays'].items()}
+            model_class = MODEL_KINDS[model['kind']]
+            models.append(model_class(model['name'], np.array(model['labels']),
+                                      model['params'], arrays))
+
+        return ModelBundle(header['vocabulary'], models, header.get('sources'))
+
+    @staticmethod
+    def _get_model_parameters(estimator):
+        """Returns the kind of model, a dict of its scalar parameters and a dict of its
+        parameter arrays for a trained scikit-learn estimator."""
+
+        estimator_name = type(estimator).__name__
+
+        if estimator_name in ('LogisticRegression', 'SGDClassifier', 'LinearSVC'):
+            return 'linear', {}, {'weights': estimator.coef_, 'bias': estimator.intercept_}
+
+        if estimator_name == 'MultinomialNB':
+            return 'linear', {}, {'weights': estimator.feature_log_prob_,
+                                  'bias': estimator.class_log_prior_}
+
+        if estimator_name == 'BernoulliNB':
+            if estimator.binarize is None or estimator.binarize >= 1:
+                raise ValueError("BernoulliNB can only be exported for binary features")
+            # With binary features, the joint log likelihood is linear in the features
+            neg_prob = np.log(1 - np.exp(estimator.feature_log_prob_))
+            return 'linear', {}, {'weights': estimator.feature_log_prob_ - neg_prob,
+                                  'bias': estimator.class_log_prior_ + neg_prob.sum(axis=1)}
+
+        if estimator_name == 'DecisionTreeClassifier':
+            tree = estimator.tree_
+            return 'tree', {}, {'children_left': tree.children_left,
+                                'children_right': tree.children_right,
+                                'feature': tree.feature, 'threshold': tree.threshold,
+                                'value': tree.value[:, 0, :]}
+
+        if estimator_name == 'MLPClassifier':
+            arrays = {}
+            for layer, (weights, bias) in enumerate(zip(estimator.coefs_,
+                                                        estimator.intercepts_)):
+                arrays[f'weights{layer}'] = weights
+                arrays[f'bias{layer}'] = bias
+            return 'neural_network', {'layers': len(estimator.coefs_),
+                                      'activation': estimator.activation,
+                                      'out_activation': estimator.out_activation_}, arrays
+
+        raise ValueError(f"{estimator_name} cannot be exported to a model bundle")
+
+    @staticmethod
+    def _add_arrays(arrays, model_arrays):
+        """Appends the arrays in the dict model_arrays to arrays. Returns a dict of each
+        array's index in arrays, dtype and shape."""
+
+        layouts = {}
+        for name, array in model_arrays.items():
+            array = np.ascontiguousarray(array)
+            layouts[name] = [len(arrays), array.dtype.str, list(array.shape)]
+            arrays.append(array)
+        return layouts
+
+    @staticmethod
+    def _write_file(filepath, header, arrays):
+        """Writes the preamble, header and arrays to filepath. The array indices in header are
+        replaced with byte offsets from the start of the array data."""
+
+        offsets = []
+        offset = 0
+        for array in arrays:
+            offsets.append(offset)
+            offset = ModelBundle._align(offset + array.nbytes)
+        for model in header['models']:
+            for layout in model['arrays'].values():
+                layout[0] = offsets[layout[0]]
+
+        header_bytes = json.dumps(header).encode()
+        data_start = ModelBundle._align(ModelBundle.PREAMBLE.size + len(header_bytes))
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        # Write to a temporary file first so a running process never sees a partial bundle.
+        # Several processes can write the bundle at once, so each writes to its own file, and
+        # whichever is renamed last wins
+        file_descriptor, temp_filepath = tempfile.mkstemp(suffix='.tmp',
+                                                          dir=os.path.dirname(filepath))
+        try:
+            with open(file_descriptor, 'wb') as bundle_file:
+                bundle_file.write(ModelBundle.PREAMBLE.pack(ModelBundle.MAGIC,
+                                                            ModelBundle.VERSION,
+                                                            len(header_bytes)))
+                bundle_file.write(header_bytes)
+                for offset, array in zip(offsets, arrays):
+                    bundle_file.write(b'\0' * (data_start + offset - bundle_file.tell()))
+                    bundle_file.write(array.tobytes())
+            os.replace(temp_filepath, filepath)
+        except BaseException:
+            os.remove(temp_filepath)
+            raise
+
+    @staticmethod
+    def _get_array(data, offset, dtype, shape):
+        """Returns a read-only view of an array stored in the memory-mapped data."""
+
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        return data[offset:offset + count*dtype.itemsize].view(dtype).reshape(shape)
+
+    @staticmethod
+    def _align(offset):
+        """Returns offset rounded up to the next multiple of ALIGNMENT."""
+
+        return -(-offset // ModelBundle.ALIGNMENT) * ModelBundle.ALIGNMENT
+
+
+class LinearModel:
+    """A model that scores each class with a linear function of the features. This covers the
+    linear classifiers and, using their log probabilities as weights, the naive Bayes
+    classifiers. A single row of weights is a binary model whose score is positive for the
+    second label."""
+
+    def __init__(self, name, labels, params, arrays):
+        self.name = name
+        self.labels = labels
+        self.weights = arrays['weights']
+        self.bias = arrays['bias']
+
+    def predict(self, feature_matrix):
+        """Returns an array of the predicted label of each row of feature_matrix."""
+
+        scores = feature_matrix @ self.weights.T + self.bias
+        if scores.shape[1] == 1:
+            return self.labels[(scores[:, 0] > 0).astype(int)]
+        return self.labels[scores.argmax(axis=1)]
+
+
+class TreeModel:
+    """A decision tree. Each row of features is passed down the tree from the root until it
+    reaches a leaf, going left when the feature value is at most the node's threshold."""
+
+    # Rows are made dense while they go down the tree, so they are handled in chunks
+    CHUNK_SIZE = 256
+
+    def __init__(self, name, labels, params, arrays):
+        self.name = name
+        self.labels = labels
+        self.children_left = arrays['children_left']
+        self.children_right = arrays['children_right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.value = arrays['value']
+
+    def predict(self, feature_matrix):
+        """Returns an array of the predicted label of each row of feature_matrix."""
+
+        leaves = [self._find_leaves(feature_matrix[start:start + TreeModel.CHUNK_SIZE])
+                  for start in range(0, feature_matrix.shape[0], TreeModel.CHUNK_SIZE)]
+        return self.labels[self.value[np.concatenate(leaves)].argmax(axis=1)]
+
+    def _find_leaves(self, feature_matrix):
+        """Returns an array of the leaf node that each row of feature_matrix reaches. All of
+        the rows move down one level of the tree at a time."""
+
+        # Trees compare features as 32 bit floats
+        features = feature_matrix.toarray().astype(np.float32)
+        rows = np.arange(features.shape[0])
+        nodes = np.zeros(features.shape[0], dtype=np.intp)
+
+        while True:
+            active = self.children_left[nodes] != -1
+            if not active.any():
+                return nodes
+            active_rows = rows[active]
+            active_nodes = nodes[active]
+            values = features[active_rows, self.feature[active_nodes]]
+            nodes[active] = np.where(values <= self.threshold[active_nodes],
+                                     self.children_left[active_nodes],
+                                     self.children_right[active_nodes])
+
+
+class NeuralNetworkModel:
+    """A multi-layer perceptron. The features are passed forward through each layer."""
+
+    activations = {'identity': lambda x: x,
+                   'logistic': expit,
+                   'tanh': np.tanh,
+                   'relu': lambda x: np.maximum(x, 0)}
+
+    def __init__(self, name, labels, params, arrays):
+        self.name = name
+        self.labels = labels
+        self.layers = [(arrays[f'weights{layer}'], arrays[f'bias{layer}'])
+                       for layer in range(params['layers'])]
+        self.activation = params['activation']
+        self.out_activation = params['out_activation']
+
+    def predict(self, feature_matrix):
+        """Returns an array of the predicted label of each row of feature_matrix."""
+
+        activation = feature_matrix
+        for layer, (weights, bias) in enumerate(self.layers):
+            activation = activation @ weights + bias
+            if layer < len(self.layers) - 1:
+                activation = NeuralNetworkModel.activations[self.activation](activation)
+
+        if self.out_activation == 'softmax':
+            # softmax does not change which output is largest
+            return self.labels[activation.argmax(axis=1)]
+        output = NeuralNetworkModel.activations[self.out_activation](activation)
+        return self.labels[(output[:, 0] > 0.5).astype(int)]
+
+
+MODEL_KINDS = {'linear': LinearModel, 'tree': TreeModel, 'neural_network': NeuralNetworkModel}
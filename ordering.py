@@ -0,0 +1,35 @@
+"""This class puts sequence-numbered results from several classification processes back into
+the order their tweets arrived in. Results can be finished out of order when more than one
+process is classifying tweets, so each result is held until every result before it has been
+released."""
+
+
+class ReorderBuffer:
+
+    def __init__(self, max_pending=1000):
+        self.next_sequence = 0
+        self.max_pending = max_pending
+        self.pending = {}
+
+    def add(self, sequence, item):
+        """Adds the item with the given sequence number. Returns a list of the items that are
+        now ready, in sequence order. An item of None marks a tweet that was dropped, so it
+        frees up its place in the sequence without being returned."""
+
+        # Anything older than the next expected item was already given up on
+        if sequence >= self.next_sequence:
+            self.pending[sequence] = item
+
+        # If too many items are waiting, the one holding them up has most likely been lost,
+        # so skip ahead to the oldest item that is still waiting
+        if len(self.pending) > self.max_pending:
+            self.next_sequence = min(self.pending)
+
+        ready = []
+        while self.next_sequence in self.pending:
+            item = self.pending.pop(self.next_sequence)
+            if item is not None:
+                ready.append(item)
+            self.next_sequence += 1
+
+        return ready
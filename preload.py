@@ -0,0 +1,21 @@
+"""This module is preloaded by the forkserver when the program is started with --warm-start,
+and imported by main.py itself when processes are forked from it. Importing it imports the
+classification modules and loads the classifiers and the vocabulary, once, before any
+classification process exists. Every classification process is then forked with all of that
+already in memory, so it can classify the first tweets as soon as they arrive instead of
+importing scikit-learn and NLTK and loading the models while the stream is already running."""
+
+import logging
+
+# Imported here so that the forked processes do not import it again
+import classification
+
+from votingclassifier import VotingClassifier
+
+
+try:
+    VotingClassifier()
+except Exception as e:
+    # The forkserver stops if importing this module fails. The classification processes load
+    # the models themselves instead
+    logging.error(f"Could not preload the models: {e}")
@@ -0,0 +1,31 @@
+"""This module moves data out of the multiprocessing queues that connect the streaming,
+classification and graphing processes. Instead of polling queue.empty() in a loop, it blocks
+until something arrives, so an idle process sleeps rather than spinning. The same functions
+work with the shared memory ring buffers in the ringbuffer module."""
+
+import queue
+
+
+def drain(source_queue, timeout, max_items):
+    """Waits up to timeout seconds for an item from source_queue, then takes the items that are
+    already waiting without blocking again, up to max_items in total. Returns a list of the
+    items, which will be empty if nothing arrived before the timeout. A timeout of None waits
+    forever."""
+
+    # A ring buffer can read everything that is waiting at once
+    get_many = getattr(source_queue, 'get_many', None)
+    if get_many is not None:
+        return get_many(max_items, timeout)
+
+    try:
+        items = [source_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+
+    while len(items) < max_items:
+        try:
+            items.append(source_queue.get_nowait())
+        except queue.Empty:
+            break
+
+    return items
@@ -0,0 +1,157 @@
+"""This class remembers the classifications of recent tweets so that duplicates do not have to
+be run through every classifier again. Quote tweets, bot spam and copy-pasted campaigns often
+repeat the same text, sometimes with a different link or mention. Tweets are matched by a hash
+of their normalized text, and optionally by SimHash fingerprints that are within a few bits of
+each other, which catches near-duplicates that differ by a word or two."""
+
+import hashlib
+import re
+import time
+
+from collections import OrderedDict
+
+from tokenizer import normalize
+
+
+class ResultCache:
+
+    FINGERPRINT_BITS = 64
+    # Fingerprints are split into this many bands for lookup. Two fingerprints that differ in
+    # fewer bits than there are bands must share at least one band exactly.
+    BANDS = 8
+    word_pattern = re.compile(r'\w+')
+
+    def __init__(self, max_size=10000, ttl=600, near_duplicates=False, max_distance=6):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.max_distance = min(max_distance, ResultCache.BANDS - 1)
+
+        # text hash -> (result, time added, fingerprint), in least recently used order
+        self.entries = OrderedDict()
+        # (band number, band value) -> set of text hashes
+        self.bands = {}
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        """Returns the cached result for text, or None if there is not one."""
+
+        normalized_text = normalize(text)
+        key = ResultCache._hash(normalized_text)
+        now = time.time()
+
+        entry = self._get_entry(key, now)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+        if self.near_duplicates:
+            fingerprint = ResultCache._get_fingerprint(normalized_text)
+            for candidate in self._get_candidates(fingerprint):
+                entry = self._get_entry(candidate, now)
+                if entry is not None and \
+                        bin(entry[2] ^ fingerprint).count('1') <= self.max_distance:
+                    self.near_hits += 1
+                    # Only the entry that is returned counts as used
+                    self.entries.move_to_end(candidate)
+                    return entry[0]
+
+        self.misses += 1
+        return None
+
+    def add(self, text, result):
+        """Caches result as the result for text. Evicts the least recently used entry if the
+        cache is full."""
+
+        normalized_text = normalize(text)
+        key = ResultCache._hash(normalized_text)
+        fingerprint = None
+        if self.near_duplicates:
+            fingerprint = ResultCache._get_fingerprint(normalized_text)
+
+        self._remove(key)
+        self.entries[key] = (result, time.time(), fingerprint)
+        if fingerprint is not None:
+            for band in ResultCache._get_bands(fingerprint):
+                self.bands.setdefault(band, set()).add(key)
+
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        """Removes every entry. Call this when the classifiers change."""
+
+        self.entries.clear()
+        self.bands.clear()
+
+    def get_hit_rate(self):
+        """Returns the fraction of lookups that found a cached result, counting both exact and
+        near-duplicate matches."""
+
+        lookups = self.hits + self.near_hits + self.misses
+        return (self.hits + self.near_hits) / lookups if lookups else 0.0
+
+    def _get_entry(self, key, now):
+        """Returns the entry for key, without marking it as recently used. Returns None and
+        removes the entry if it is older than the ttl."""
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if now - entry[1] > self.ttl:
+            self._remove(key)
+            return None
+        return entry
+
+    def _get_candidates(self, fingerprint):
+        """Returns the set of keys whose fingerprints share at least one band with
+        fingerprint."""
+
+        candidates = set()
+        for band in ResultCache._get_bands(fingerprint):
+            candidates.update(self.bands.get(band, ()))
+        return candidates
+
+    def _remove(self, key):
+        """Removes the entry for key, if there is one, along with its band references."""
+
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[2] is None:
+            return
+        for band in ResultCache._get_bands(entry[2]):
+            keys = self.bands.get(band)
+            keys.discard(key)
+            if not keys:
+                del self.bands[band]
+
+    @staticmethod
+    def _hash(text):
+        """Returns a stable 64 bit hash of text."""
+
+        return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
+
+    @staticmethod
+    def _get_fingerprint(normalized_text):
+        """Returns the SimHash fingerprint of the words in normalized_text. Texts that share
+        most of their words will have fingerprints that differ in only a few bits."""
+
+        weights = [0] * ResultCache.FINGERPRINT_BITS
+        for word in set(ResultCache.word_pattern.findall(normalized_text)):
+            word_hash = ResultCache._hash(word)
+            for bit in range(ResultCache.FINGERPRINT_BITS):
+                weights[bit] += 1 if word_hash >> bit & 1 else -1
+
+        return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+    @staticmethod
+    def _get_bands(fingerprint):
+        """Returns the (band number, band value) pairs of fingerprint."""
+
+        band_bits = ResultCache.FINGERPRINT_BITS // ResultCache.BANDS
+        mask = (1 << band_bits) - 1
+        return [(band, fingerprint >> band * band_bits & mask)
+                for band in range(ResultCache.BANDS)]
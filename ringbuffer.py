@@ -0,0 +1,264 @@
+"""These classes are an alternative to the multiprocessing queues between the streaming,
+classification and graphing processes. A multiprocessing.Queue pickles every item and sends it
+through a pipe, waking a feeder thread for each one. A RingBuffer instead copies each item into
+a fixed-size block of shared memory as a compact, length-prefixed record, and readers copy
+records straight back out. Several records can be written or read while holding the lock once.
+
+The ring buffers have the same put, get, get_nowait and qsize methods as a queue, plus put_many
+and get_many for batches, so the processes use them without knowing which they were given. The
+one difference is that a ring buffer has a fixed capacity. If there is not enough room for a
+record, it is dropped and counted in overflow_count rather than making the writer wait, like
+the tweets that are dropped when classification falls behind. Its sequence number has already
+been used, so a small placeholder marking it as dropped is written in its place, and the
+processes downstream do not wait for it. A part of the buffer is kept free for placeholders,
+so they still fit when nothing else does.
+
+TweetRing holds the (sequence number, text, keywords) tuples sent from the stream to
+classification, and ResultRing holds the (sequence number, (text, sentiment, confidence,
+keywords, confidence is a lower bound)) results sent from classification to graphing. Keywords
+are stored as a bitmask of the tracked keywords, so at most MAX_KEYWORDS can be tracked."""
+
+import abc
+import multiprocessing
+import queue
+import struct
+
+from multiprocessing import shared_memory
+
+
+CAPACITY = 4 * 1024 * 1024
+MAX_KEYWORDS = 64
+
+
+class RingBuffer(abc.ABC):
+    """A ring buffer of records of bytes in shared memory, capacity bytes in size, of which
+    reserve bytes (a sixteenth by default) are kept for placeholders of dropped items. It is
+    created by the parent process and can be passed to child processes. Any number of
+    processes can write to it and read from it. Subclasses must implement _encode and _decode
+    to turn items into records and back, and _encode_dropped to make placeholders."""
+
+    # Bytes written and read since the buffer was created, the number of records waiting, and
+    # the number of records dropped because the buffer was full
+    header = struct.Struct('<QQQQ')
+    length_prefix = struct.Struct('<I')
+
+    def __init__(self, capacity=CAPACITY, reserve=None):
+        self.capacity = capacity
+        self.reserve = capacity // 16 if reserve is None else reserve
+        self.memory = shared_memory.SharedMemory(create=True,
+                                                 size=RingBuffer.header.size + capacity)
+        RingBuffer.header.pack_into(self.memory.buf, 0, 0, 0, 0, 0)
+        # Guards the header, and wakes up readers when records are written
+        self.condition = multiprocessing.Condition()
+
+    def put(self, item):
+        """Writes item to the buffer. Returns False if there was no room for it."""
+
+        return self.put_many([item]) == 1
+
+    def put_many(self, items):
+        """Writes the items to the buffer, in order. Items that do not fit are dropped, and a
+        placeholder is written in their place if there is room for it in the reserve. Returns
+        the number of items written."""
+
+        records = [self._encode(item) for item in items]
+        written = 0
+        records_written = 0
+        with self.condition:
+            write_position, read_position, count, overflow_count = \
+                RingBuffer.header.unpack_from(self.memory.buf, 0)
+            for item, record in zip(items, records):
+                free = self.capacity - (write_position - read_position)
+                if RingBuffer.length_prefix.size + len(record) > free - self.reserve:
+                    overflow_count += 1
+                    record = self._encode_dropped(item)
+                    if RingBuffer.length_prefix.size + len(record) > free:
+                        continue
+                else:
+                    written += 1
+                self._copy_in(write_position, RingBuffer.length_prefix.pack(len(record)))
+                self._copy_in(write_position + RingBuffer.length_prefix.size, record)
+                write_position += RingBuffer.length_prefix.size + len(record)
+                records_written += 1
+            RingBuffer.header.pack_into(self.memory.buf, 0, write_position, read_position,
+                                        count + records_written, overflow_count)
+            if records_written:
+                self.condition.notify_all()
+        return written
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the oldest item. Waits up to timeout seconds for one if block is
+        True, or forever if timeout is None. Raises queue.Empty if there is none."""
+
+        items = self.get_many(1, timeout if block else 0)
+        if not items:
+            raise queue.Empty
+        return items[0]
+
+    def get_nowait(self):
+        """Removes and returns the oldest item, or raises queue.Empty if there is none."""
+
+        return self.get(block=False)
+
+    def get_many(self, max_items, timeout=None):
+        """Waits up to timeout seconds for an item, or forever if timeout is None, then removes
+        and returns a list of up to max_items of the oldest items. The list is empty if nothing
+        arrived before the timeout."""
+
+        records = []
+        with self.condition:
+            if not self.condition.wait_for(self._has_records, timeout):
+                return []
+            write_position, read_position, count, overflow_count = \
+                RingBuffer.header.unpack_from(self.memory.buf, 0)
+            while len(records) < min(max_items, count):
+                length, = RingBuffer.length_prefix.unpack(
+                    self._copy_out(read_position, RingBuffer.length_prefix.size))
+                read_position += RingBuffer.length_prefix.size
+                records.append(self._copy_out(read_position, length))
+                read_position += length
+            RingBuffer.header.pack_into(self.memory.buf, 0, write_position, read_position,
+                                        count - len(records), overflow_count)
+        return [self._decode(record) for record in records]
+
+    def qsize(self):
+        """Returns the number of items waiting in the buffer."""
+
+        return RingBuffer.header.unpack_from(self.memory.buf, 0)[2]
+
+    @property
+    def overflow_count(self):
+        """The number of items that have been dropped because the buffer was full."""
+
+        return RingBuffer.header.unpack_from(self.memory.buf, 0)[3]
+
+    def close(self):
+        """Detaches this process from the shared memory."""
+
+        self.memory.close()
+
+    def unlink(self):
+        """Frees the shared memory. Must be called once, by the process that created the
+        buffer, after every process has finished with it."""
+
+        self.memory.close()
+        self.memory.unlink()
+
+    def _has_records(self):
+        """Returns whether there are any records waiting."""
+
+        return self.qsize() > 0
+
+    def _copy_in(self, position, data):
+        """Copies data into the buffer at position, wrapping around the end of the buffer."""
+
+        start = RingBuffer.header.size + position % self.capacity
+        first_part = min(len(data), RingBuffer.header.size + self.capacity - start)
+        self.memory.buf[start:start + first_part] = data[:first_part]
+        if first_part < len(data):
+            self.memory.buf[RingBuffer.header.size:
+                            RingBuffer.header.size + len(data) - first_part] = data[first_part:]
+
+    def _copy_out(self, position, length):
+        """Returns a copy of the length bytes in the buffer at position, wrapping around the end
+        of the buffer."""
+
+        start = RingBuffer.header.size + position % self.capacity
+        first_part = min(length, RingBuffer.header.size + self.capacity - start)
+        data = bytes(self.memory.buf[start:start + first_part])
+        if first_part < length:
+            data += bytes(self.memory.buf[RingBuffer.header.size:
+                                          RingBuffer.header.size + length - first_part])
+        return data
+
+    @abc.abstractmethod
+    def _encode(self, item):
+        """Returns item as a record of bytes."""
+
+    @abc.abstractmethod
+    def _decode(self, record):
+        """Returns the item in a record of bytes."""
+
+    @abc.abstractmethod
+    def _encode_dropped(self, item):
+        """Returns a short record of the placeholder that replaces item when it is dropped."""
+
+
+class KeywordRingBuffer(RingBuffer):
+    """Base class for ring buffers whose items carry a tuple of the keywords in the list
+    keywords, which are stored as a bitmask."""
+
+    def __init__(self, keywords=(), capacity=CAPACITY, reserve=None):
+        if len(keywords) > MAX_KEYWORDS:
+            raise ValueError(f'At most {MAX_KEYWORDS} keywords can be sent through shared '
+                             f'memory, not {len(keywords)}')
+        super().__init__(capacity, reserve)
+        self.keywords = list(keywords)
+
+    def _encode_keywords(self, keywords):
+        """Returns the bitmask of a tuple of keywords."""
+
+        return sum(1 << self.keywords.index(keyword) for keyword in keywords)
+
+    def _decode_keywords(self, bitmask):
+        """Returns the tuple of keywords in a bitmask, in the order they were given."""
+
+        return tuple(keyword for i, keyword in enumerate(self.keywords) if bitmask >> i & 1)
+
+
+class TweetRing(KeywordRingBuffer):
+    """Holds (sequence number, text, keywords) tuples. Each record is the sequence number,
+    keyword bitmask and a byte that is 1 for a placeholder, followed by the text in UTF-8. A
+    placeholder is read back as (sequence number, None, ()), which classification sends on as
+    a dropped tweet."""
+
+    record_header = struct.Struct('<QQB')
+
+    def _encode(self, item):
+        sequence_number, text, keywords = item
+        return TweetRing.record_header.pack(sequence_number, self._encode_keywords(keywords),
+                                            0) + text.encode()
+
+    def _decode(self, record):
+        sequence_number, bitmask, dropped = TweetRing.record_header.unpack_from(record)
+        if dropped:
+            return sequence_number, None, ()
+        return (sequence_number, record[TweetRing.record_header.size:].decode(),
+                self._decode_keywords(bitmask))
+
+    def _encode_dropped(self, item):
+        return TweetRing.record_header.pack(item[0], 0, 1)
+
+
+class ResultRing(KeywordRingBuffer):
+    """Holds (sequence number, (text, sentiment, confidence, keywords, confidence is a lower
+    bound)) results, or (sequence number, None) for a dropped tweet. Each record is a
+    fixed-width sequence number, sentiment byte, lower bound flag, 32-bit confidence and
+    keyword bitmask, followed by the text in UTF-8. The sentiment byte is 0 for a dropped
+    tweet."""
+
+    record_header = struct.Struct('<QB?fQ')
+    sentiments = (None, 'pos', 'neg')
+
+    def _encode(self, item):
+        sequence_number, result = item
+        if result is None:
+            return ResultRing.record_header.pack(sequence_number, 0, False, 0.0, 0)
+        text, sentiment, confidence, keywords, lower_bound = result
+        return ResultRing.record_header.pack(sequence_number,
+                                             ResultRing.sentiments.index(sentiment),
+                                             lower_bound, confidence,
+                                             self._encode_keywords(keywords)) \
+            + text.encode()
+
+    def _encode_dropped(self, item):
+        return self._encode((item[0], None))
+
+    def _decode(self, record):
+        sequence_number, sentiment, lower_bound, confidence, bitmask = \
+            ResultRing.record_header.unpack_from(record)
+        if not sentiment:
+            return sequence_number, None
+        return sequence_number, (record[ResultRing.record_header.size:].decode(),
+                                 ResultRing.sentiments[sentiment], confidence,
+                                 self._decode_keywords(bitmask), lower_bound)
@@ -0,0 +1,154 @@
+"""These classes keep running totals of the sentiment of the most recent tweets, so that the
+average sentiment and the rate that tweets are arriving at can be read at any time without
+going over every tweet again. A tweet's confidence is added to the totals when it enters the
+window and subtracted when it leaves, so adding a tweet takes the same time however large the
+window is. CountWindow holds the last few tweets, and TimeWindow holds the tweets from the last
+few seconds, grouped into buckets."""
+
+import abc
+import math
+import time
+
+from collections import deque
+
+
+class SentimentWindow(abc.ABC):
+    """Base class for the windows. Holds the total confidence of the positive and negative
+    tweets in the window. Subclasses must implement add, get_count and get_rate."""
+
+    def __init__(self):
+        self.positive_weight = 0.0
+        self.negative_weight = 0.0
+
+    @abc.abstractmethod
+    def add(self, sentiment, confidence, now=None):
+        """Adds a tweet classified as sentiment, either pos or neg, with the given confidence.
+        now is the time the tweet arrived, which defaults to the current time."""
+
+    @abc.abstractmethod
+    def get_count(self, now=None):
+        """Returns the number of tweets in the window."""
+
+    @abc.abstractmethod
+    def get_rate(self, now=None):
+        """Returns the number of tweets per second that arrived during the window."""
+
+    def get_positivity(self, now=None):
+        """Returns the share of the confidence in the window that is positive, from 0 to 1, or
+        None if the window is empty."""
+
+        if self.get_count(now) == 0:
+            return None
+        total_weight = self.positive_weight + self.negative_weight
+        return self.positive_weight / total_weight if total_weight > 0 else 0.5
+
+    def _change_weights(self, sentiment, confidence):
+        """Adds confidence to the weight of sentiment. A negative confidence removes it."""
+
+        if sentiment == 'pos':
+            self.positive_weight += confidence
+        elif sentiment == 'neg':
+            self.negative_weight += confidence
+
+    def _reset_weights(self):
+        """Zeroes the weights once the window is empty, so that rounding errors from adding and
+        subtracting do not build up."""
+
+        self.positive_weight = 0.0
+        self.negative_weight = 0.0
+
+
+class CountWindow(SentimentWindow):
+    """Holds the last size tweets."""
+
+    def __init__(self, size):
+        super().__init__()
+        # (arrival time, sentiment, confidence) of each tweet, oldest first
+        self.tweets = deque()
+        self.size = size
+
+    def add(self, sentiment, confidence, now=None):
+        if len(self.tweets) == self.size:
+            _, old_sentiment, old_confidence = self.tweets.popleft()
+            self._change_weights(old_sentiment, -old_confidence)
+
+        self.tweets.append((time.time() if now is None else now, sentiment, confidence))
+        self._change_weights(sentiment, confidence)
+
+    def get_count(self, now=None):
+        return len(self.tweets)
+
+    def get_rate(self, now=None):
+        """Returns the number of tweets in the window divided by the time since the oldest one
+        arrived."""
+
+        if not self.tweets:
+            return 0.0
+        elapsed = (time.time() if now is None else now) - self.tweets[0][0]
+        return len(self.tweets) / elapsed if elapsed > 0 else 0.0
+
+
+class TimeWindow(SentimentWindow):
+    """Holds the tweets that arrived in the last seconds seconds. Tweets are counted in buckets
+    of bucket_seconds seconds, and a whole bucket leaves the window at once, so the window
+    really covers between seconds - bucket_seconds and seconds seconds."""
+
+    def __init__(self, seconds=60, bucket_seconds=1):
+        super().__init__()
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = math.ceil(seconds / bucket_seconds)
+        # [bucket number, tweet count, positive weight, negative weight], oldest first
+        self.buckets = deque()
+        self.count = 0
+        self.start_time = None
+
+    def add(self, sentiment, confidence, now=None):
+        now = time.time() if now is None else now
+        if self.start_time is None:
+            self.start_time = now
+        self._expire(now)
+
+        # A tweet that arrives out of order goes in the newest bucket rather than an old one
+        bucket_number = int(now // self.bucket_seconds)
+        if not self.buckets or self.buckets[-1][0] < bucket_number:
+            self.buckets.append([bucket_number, 0, 0.0, 0.0])
+        bucket = self.buckets[-1]
+
+        bucket[1] += 1
+        if sentiment == 'pos':
+            bucket[2] += confidence
+        elif sentiment == 'neg':
+            bucket[3] += confidence
+        self.count += 1
+        self._change_weights(sentiment, confidence)
+
+    def get_count(self, now=None):
+        self._expire(time.time() if now is None else now)
+        return self.count
+
+    def get_rate(self, now=None):
+        """Returns the number of tweets in the window divided by the length of the window, or
+        by the time since the first tweet if that is shorter."""
+
+        now = time.time() if now is None else now
+        self._expire(now)
+        if self.start_time is None:
+            return 0.0
+
+        window_start = (int(now // self.bucket_seconds) - self.bucket_count + 1) * \
+            self.bucket_seconds
+        elapsed = now - max(window_start, self.start_time)
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def _expire(self, now):
+        """Removes the buckets that are too old to be in the window at time now."""
+
+        oldest_bucket = int(now // self.bucket_seconds) - self.bucket_count + 1
+        while self.buckets and self.buckets[0][0] < oldest_bucket:
+            _, count, positive_weight, negative_weight = self.buckets.popleft()
+            self.count -= count
+            self.positive_weight -= positive_weight
+            self.negative_weight -= negative_weight
+
+        if not self.buckets:
+            self._reset_weights()
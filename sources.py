@@ -0,0 +1,147 @@
+"""This module provides the sources that tweets can be streamed from. A source is a function
+that takes a list of keywords and a queue, and puts the tweets that contain any of the keywords
+in the queue as (sequence number, text, matching keywords) tuples until it is stopped.
+start_stream in the streaming module pulls live tweets from Twitter. start_replay replays a file
+of saved tweets instead, so the rest of the program can be run and load-tested without Twitter
+credentials.
+
+Replayed tweets go through the same KeywordStreamListener as live ones. ReplayStream stands in
+for tweepy.Stream and hands each tweet to the listener as the raw JSON message that Twitter
+would have sent, so the listener's parsing and retweet filtering are exercised as well."""
+
+import functools
+import json
+import logging
+import time
+
+from keywords import KeywordMatcher
+from metrics import Metrics
+from streamlistener import KeywordStreamListener
+from streaming import start_stream
+
+
+# fixed sends tweets evenly spaced, bursty sends them in bursts of BURST_SIZE tweets with the
+# same average rate, and max sends them as fast as the queue will take them
+RATE_MODES = ('fixed', 'bursty', 'max')
+BURST_SIZE = 100
+
+
+def get_source(replay_filepath=None, rate=None, mode='fixed'):
+    """Returns the source function to run in the streaming process. This is start_stream
+    unless replay_filepath is given, in which case the tweets in that file are replayed at rate
+    tweets per second."""
+
+    if replay_filepath is None:
+        return start_stream
+    return functools.partial(start_replay, filepath=replay_filepath, rate=rate, mode=mode)
+
+
+def start_replay(keywords, queue, filepath, rate=None, mode='fixed', loop=True,
+                 metrics_queue=None):
+    """Replays the tweets in filepath that contain any of the keywords in the list keywords,
+    putting them in queue at rate tweets per second. Every tweet is replayed if keywords is
+    empty. If loop is True, the file is replayed from the start each time it runs out. Metrics
+    are sent to metrics_queue, if it is given."""
+
+    Metrics.connect(metrics_queue)
+    stream_listener = KeywordStreamListener(queue, keywords)
+    stream = ReplayStream(stream_listener, filepath, rate, mode, loop=loop)
+
+    logging.debug(f'Replaying tweets from {filepath}')
+    stream.filter(track=keywords or None)
+    stream_listener.flush()
+
+
+class ReplayStream:
+    """Replays a file of tweets to a tweepy StreamListener with the same filter method as
+    tweepy.Stream. Each line of the file is either a tweet in Twitter's JSON format, a JSON
+    object with a text field, or the plain text of a tweet."""
+
+    def __init__(self, listener, filepath, rate=None, mode='fixed', burst_size=BURST_SIZE,
+                 loop=False, limit=None):
+        if mode not in RATE_MODES:
+            raise ValueError(f"mode must be one of {', '.join(RATE_MODES)}")
+        if mode != 'max' and not rate:
+            raise ValueError(f"a rate is needed for the {mode} mode")
+
+        self.listener = listener
+        self.filepath = filepath
+        self.rate = rate
+        self.mode = mode
+        self.burst_size = burst_size
+        self.loop = loop
+        self.limit = limit
+        self.sent = 0
+
+    def filter(self, track=None, stall_warnings=False):
+        """Sends the tweets that contain any of the keywords in track to the listener, like
+        Twitter's filter endpoint does. Every tweet is sent if track is None. Returns once the
+        file has been replayed, limit tweets have been sent, or the listener returns False."""
+
+        matcher = KeywordMatcher(track) if track else None
+        tweets = [raw_data for text, raw_data in ReplayStream._read_tweets(self.filepath)
+                  if matcher is None or matcher.find(text)]
+        if not tweets:
+            logging.error(f'No tweets to replay in {self.filepath}')
+            return
+
+        start = time.time()
+        while self.limit is None or self.sent < self.limit:
+            raw_data = tweets[self.sent % len(tweets)]
+            self._wait(start)
+            self.sent += 1
+            if self.listener.on_data(raw_data) is False:
+                return
+            if not self.loop and self.sent == len(tweets):
+                return
+
+    def _wait(self, start):
+        """Sleeps until it is time to send the next tweet, counting from start. Tweets are
+        scheduled from the start time rather than from the previous tweet, so time spent in the
+        listener does not slow down the rate."""
+
+        if self.mode == 'max':
+            return
+        if self.mode == 'bursty':
+            send_time = start + self.sent // self.burst_size * self.burst_size / self.rate
+        else:
+            send_time = start + self.sent / self.rate
+
+        delay = send_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    @staticmethod
+    def _read_tweets(filepath):
+        """Returns a list of (lowercase text, raw JSON message) pairs of the tweets in
+        filepath."""
+
+        tweets = []
+        with open(filepath, encoding='utf-8', errors='replace') as tweet_file:
+            for line in tweet_file:
+                line = line.strip()
+                if not line:
+                    continue
+                tweet = ReplayStream._parse_line(line)
+                try:
+                    text = tweet['extended_tweet']['full_text']
+                except KeyError:
+                    text = tweet['text']
+                tweets.append((text.lower(), json.dumps(tweet)))
+        return tweets
+
+    @staticmethod
+    def _parse_line(line):
+        """Returns the tweet on line as a dict in Twitter's JSON format."""
+
+        if line.startswith('{'):
+            try:
+                tweet = json.loads(line)
+            except ValueError:
+                tweet = None
+            if isinstance(tweet, dict) and ('text' in tweet or 'extended_tweet' in tweet):
+                # tweepy only treats messages with this field as tweets
+                tweet.setdefault('in_reply_to_status_id', None)
+                return tweet
+
+        return {'text': line, 'in_reply_to_status_id': None}
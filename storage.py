@@ -0,0 +1,176 @@
+"""This module saves the classified tweets to an SQLite database, so that they outlive the
+graphs. The classification processes send each batch of results to a separate storage process,
+so writing to disk never holds up classification. The storage process groups everything that
+arrives within COMMIT_INTERVAL seconds into a single transaction, and the database is in WAL
+mode, so it can be read while it is being written to.
+
+Each tweet is stored once for every keyword it belongs to, as its timestamp, keyword, label,
+confidence, a hash of its text, and whether the confidence is only a lower bound because the
+cascade stopped early. The text itself is not kept. Alongside the tweets, the
+number of tweets and their total positive and negative confidence are kept for every minute and
+every hour. These rollups are updated as each transaction is written, so the trend over a long
+period can be read from a few rows instead of adding up every tweet."""
+
+import hashlib
+import logging
+import sqlite3
+import time
+
+from metrics import Metrics
+from queueing import drain
+
+
+DB_FILEPATH = 'tweets.db'
+COMMIT_INTERVAL = 1
+MAX_DRAIN = 1000
+# Name of each rollup table and the number of seconds in each of its buckets
+ROLLUPS = {'minute': 60, 'hour': 3600}
+# INSERT ... ON CONFLICT DO UPDATE needs SQLite 3.24. Older versions update the rollups in two
+# statements instead
+UPSERT_VERSION = (3, 24, 0)
+
+
+def start_storage(queue, filepath=DB_FILEPATH, metrics_queue=None,
+                  commit_interval=COMMIT_INTERVAL):
+    """Pulls batches of classified tweets from queue and saves them to the database at
+    filepath, writing one transaction every commit_interval seconds while tweets are arriving.
+    Each batch is a (timestamp, classified tweets) pair, where the classified tweets are in the
+    form sent to the graphing module. Runs until None is put in queue, after writing everything
+    that came before it. Metrics are sent to metrics_queue, if it is given."""
+
+    Metrics.connect(metrics_queue)
+    store = TweetStore(filepath)
+    logging.debug(f"Storing classified tweets in {filepath}")
+
+    stopping = False
+    while not stopping:
+        # Wait as long as it takes for the first batch, then collect the rest of the
+        # transaction for up to commit_interval seconds
+        batches = drain(queue, None, MAX_DRAIN)
+        commit_time = time.time() + commit_interval
+        while None not in batches and time.time() < commit_time:
+            batches.extend(drain(queue, commit_time - time.time(), MAX_DRAIN))
+        stopping = None in batches
+
+        rows = _get_rows(batch for batch in batches if batch is not None)
+        if rows:
+            start = time.perf_counter()
+            store.add(rows)
+            Metrics.observe('store_write_seconds', time.perf_counter() - start)
+            Metrics.increment('tweets_stored_total', len(rows))
+
+    store.close()
+    logging.debug("Stopped storing classified tweets")
+
+
+def _get_rows(batches):
+    """Returns a list of (timestamp, keyword, label, confidence, text hash, lower bound) rows
+    for the classified tweets in batches. A tweet with no keywords is stored with an empty
+    keyword."""
+
+    rows = []
+    for timestamp, classified_tweets in batches:
+        for _, (text, label, confidence, keywords, lower_bound) in classified_tweets:
+            text_hash = hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+            for keyword in keywords or ('',):
+                rows.append((timestamp, keyword, label, confidence, text_hash, lower_bound))
+    return rows
+
+
+class TweetStore:
+    """The database of classified tweets and their rollups."""
+
+    def __init__(self, filepath=DB_FILEPATH):
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, NORMAL can only lose the last transactions in a power failure, and does
+        # not sync on every commit
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tweets (timestamp REAL, '
+                                    'keyword TEXT, label TEXT, confidence REAL, '
+                                    'text_hash TEXT, confidence_is_lower_bound INTEGER)')
+            # Databases written before the lower bound was stored are missing its column. Their
+            # rows are left as NULL, since it is not known which of them were lower bounds
+            columns = [column[1] for column in
+                       self.connection.execute('PRAGMA table_info(tweets)')]
+            if 'confidence_is_lower_bound' not in columns:
+                self.connection.execute('ALTER TABLE tweets '
+                                        'ADD COLUMN confidence_is_lower_bound INTEGER')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tweets_keyword_timestamp ON '
+                                    'tweets (keyword, timestamp)')
+            for rollup in ROLLUPS:
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS tweets_per_{rollup} ('
+                                        'keyword TEXT, bucket INTEGER, tweet_count INTEGER, '
+                                        'positive_weight REAL, negative_weight REAL, '
+                                        'PRIMARY KEY (keyword, bucket))')
+
+    def add(self, rows):
+        """Adds the (timestamp, keyword, label, confidence, text hash, lower bound) rows, and
+        updates the rollups, in a single transaction."""
+
+        with self.connection:
+            self.connection.executemany('INSERT INTO tweets VALUES (?, ?, ?, ?, ?, ?)', rows)
+            for rollup, bucket_seconds in ROLLUPS.items():
+                rollup_rows = TweetStore._get_rollup_rows(rows, bucket_seconds)
+                if sqlite3.sqlite_version_info >= UPSERT_VERSION:
+                    self.connection.executemany(
+                        f'INSERT INTO tweets_per_{rollup} VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (keyword, bucket) DO UPDATE SET '
+                        'tweet_count = tweet_count + excluded.tweet_count, '
+                        'positive_weight = positive_weight + excluded.positive_weight, '
+                        'negative_weight = negative_weight + excluded.negative_weight',
+                        rollup_rows)
+                else:
+                    self.connection.executemany(
+                        f'INSERT OR IGNORE INTO tweets_per_{rollup} VALUES (?, ?, 0, 0, 0)',
+                        [(keyword, bucket) for keyword, bucket, *_ in rollup_rows])
+                    self.connection.executemany(
+                        f'UPDATE tweets_per_{rollup} SET tweet_count = tweet_count + ?, '
+                        'positive_weight = positive_weight + ?, '
+                        'negative_weight = negative_weight + ? '
+                        'WHERE keyword = ? AND bucket = ?',
+                        [(*totals, keyword, bucket)
+                         for keyword, bucket, *totals in rollup_rows])
+
+    def get_trend(self, keyword, rollup='minute', start=None, end=None):
+        """Returns a list of (bucket start time, tweet count, positivity) tuples for keyword,
+        oldest first, from the rollup named rollup, either minute or hour. Only the buckets that
+        overlap the time from start to end are returned, if they are given. Positivity is the
+        share of the confidence that is positive, from 0 to 1, as in SentimentWindow."""
+
+        bucket_seconds = ROLLUPS[rollup]
+        start_bucket = -1 if start is None else int(start // bucket_seconds)
+        end_bucket = float('inf') if end is None else int(end // bucket_seconds)
+        cursor = self.connection.execute(
+            'SELECT bucket, tweet_count, positive_weight, negative_weight '
+            f'FROM tweets_per_{rollup} WHERE keyword = ? AND bucket BETWEEN ? AND ? '
+            'ORDER BY bucket', (keyword, start_bucket, end_bucket))
+
+        trend = []
+        for bucket, tweet_count, positive_weight, negative_weight in cursor:
+            total_weight = positive_weight + negative_weight
+            trend.append((bucket * bucket_seconds, tweet_count,
+                          positive_weight / total_weight if total_weight > 0 else 0.5))
+        return trend
+
+    def close(self):
+        """Closes the database."""
+
+        self.connection.close()
+
+    @staticmethod
+    def _get_rollup_rows(rows, bucket_seconds):
+        """Returns a list of (keyword, bucket, tweet count, positive weight, negative weight)
+        totals of rows, for buckets of bucket_seconds seconds."""
+
+        totals = {}
+        for timestamp, keyword, label, confidence, *_ in rows:
+            bucket = int(timestamp // bucket_seconds)
+            total = totals.setdefault((keyword, bucket), [0, 0.0, 0.0])
+            total[0] += 1
+            if label == 'pos':
+                total[1] += confidence
+            elif label == 'neg':
+                total[2] += confidence
+        return [(keyword, bucket, *total) for (keyword, bucket), total in totals.items()]
@@ -2,35 +2,58 @@
 
 
 import logging
+import time
 import tweepy
 
 from collections import namedtuple
 
+from backoff import NETWORK, get_backoffs
+from metrics import Metrics
 from streamlistener import KeywordStreamListener
 
 CONFIG = 'keys.txt'
 
 
-def start_stream(keyword, queue):
-    """Runs the tweepy stream to pull tweets containing the given keyword from Twitter."""
+def start_stream(keywords, queue, metrics_queue=None):
+    """Runs the tweepy stream to pull tweets containing any of the keywords in the list
+    keywords from Twitter. Metrics are sent to metrics_queue, if it is given.
 
-    stream = _get_stream(queue)
+    Whenever the stream stops, it is reconnected after a delay that depends on the class of
+    error that stopped it, see the backoff module. The delays start again from the shortest
+    once a connection succeeds."""
+
+    Metrics.connect(metrics_queue)
+    stream = _get_stream(queue, keywords)
+    backoffs = get_backoffs()
 
     logging.debug('Starting stream')
 
     while True:
+        stream.listener.start_connection()
         try:
-            stream.filter(track=[keyword], stall_warnings=True)
+            stream.filter(track=keywords, stall_warnings=True)
         except Exception as e:
             logging.error(e)
+        stream.listener.flush()
+
+        if stream.listener.connected:
+            for backoff in backoffs.values():
+                backoff.reset()
+        # The stream also stops without an error when Twitter closes the connection
+        error_class = stream.listener.error_class or NETWORK
+        delay = backoffs[error_class].next_delay()
+        Metrics.increment('stream_reconnects_total', error_class=error_class)
+        Metrics.increment('stream_backoff_seconds_total', delay)
+        logging.warning(f'Stream stopped ({error_class}), reconnecting in {delay:.2f}s')
+        time.sleep(delay)
 
 
-def _get_stream(queue):
+def _get_stream(queue, keywords):
     """Returns a configured tweepy.Stream object."""
 
     api = _get_tweepy_api()
 
-    stream_listener = KeywordStreamListener(queue)
+    stream_listener = KeywordStreamListener(queue, keywords)
     stream = tweepy.Stream(auth=api.auth, listener=stream_listener)
 
     return stream
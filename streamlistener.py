@@ -1,12 +1,48 @@
+import itertools
 import logging
+import threading
+import time
 import tweepy
 
+from backoff import HTTP, NETWORK, RATE_LIMIT
+from keywords import KeywordMatcher
+from metrics import Metrics
+
+
+# Tweets are sent on once this many are waiting, or FLUSH_INTERVAL seconds after the first of
+# them was buffered
+FLUSH_SIZE = 50
+FLUSH_INTERVAL = 0.05
+# HTTP statuses Twitter uses when a client connects too often
+RATE_LIMIT_STATUSES = (420, 429)
+
 
 class KeywordStreamListener(tweepy.StreamListener):
+    """Puts the tweets from the stream that are not retweets in queue. Tweets are held in a
+    buffer and put in the queue in batches of up to flush_size, or flush_interval seconds after
+    the first of them arrived, instead of one at a time. If the stream stops because of an error, the class of
+    the error is kept in error_class so that start_stream can back off accordingly."""
 
-    def __init__(self, queue):
+    def __init__(self, queue, keywords=(), flush_size=FLUSH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
         super().__init__()
         self.queue = queue
+        # Numbers each tweet in arrival order so that results can be put back in order
+        # after being classified by several processes
+        self.sequence = itertools.count()
+        # Tags each tweet with the keywords it belongs to
+        self.matcher = KeywordMatcher(keywords) if keywords else None
+
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.lock = threading.Lock()
+        # Wakes the flush thread when a tweet is added to an empty buffer
+        self.tweet_buffered = threading.Condition(self.lock)
+        self.flush_thread = None
+
+        self.connected = False
+        self.error_class = None
 
     def on_status(self, status):
         try:
@@ -15,8 +51,78 @@ class KeywordStreamListener(tweepy.StreamListener):
         except AttributeError:
             # Fall back to normal text field for non-extended tweets
             text = status.text.strip()
+        Metrics.increment('tweets_received_total')
         if not text.startswith('RT @'):
-            self.queue.put(text.strip())
+            text = text.strip()
+            keywords = self.matcher.tag(text) if self.matcher else ()
+            for keyword in keywords:
+                Metrics.increment('tweets_matched_total', keyword=keyword)
+            self._add((next(self.sequence), text, keywords))
+        else:
+            Metrics.increment('retweets_filtered_total')
+
+    def on_connect(self):
+        logging.debug('Connected to the stream')
+        self.connected = True
+
+    def on_error(self, status_code):
+        logging.error(f'Stream returned HTTP {status_code}')
+        self.error_class = RATE_LIMIT if status_code in RATE_LIMIT_STATUSES else HTTP
+        # Stop tweepy from reconnecting by itself, so that start_stream can back off
+        return False
+
+    def on_timeout(self):
+        logging.error('Stream timed out')
+        self.error_class = NETWORK
+        return False
+
+    def on_exception(self, exception):
+        self.error_class = NETWORK
+
+    def start_connection(self):
+        """Forgets the state of the last connection before the stream connects again."""
+
+        self.connected = False
+        self.error_class = None
+
+    def flush(self, trigger='stop'):
+        """Puts every buffered tweet in the queue. trigger is the reason, for the metrics."""
+
+        with self.lock:
+            if not self.buffer:
+                return
+            put_many = getattr(self.queue, 'put_many', None)
+            if put_many is not None:
+                put_many(self.buffer)
+            else:
+                for tweet in self.buffer:
+                    self.queue.put(tweet)
+            self.buffer = []
+        Metrics.increment('listener_flushes_total', trigger=trigger)
+
+    def _add(self, tweet):
+        """Buffers tweet, and sends the buffer on if it is full."""
+
+        with self.lock:
+            self.buffer.append(tweet)
+            if len(self.buffer) == 1:
+                self.tweet_buffered.notify()
+            full = len(self.buffer) >= self.flush_size
+            if self.flush_thread is None and not full:
+                self.flush_thread = threading.Thread(target=self._flush_periodically,
+                                                     daemon=True)
+                self.flush_thread.start()
+        if full:
+            self.flush('size')
+
+    def _flush_periodically(self):
+        """Sends on the buffered tweets flush_interval seconds after the first of them was
+        buffered, so that none wait long when tweets are arriving slowly. While the buffer is
+        empty, the thread sleeps until a tweet is added. Runs forever."""
 
-    def on_error(self, code):
-        logging.error(code)
+        while True:
+            with self.tweet_buffered:
+                while not self.buffer:
+                    self.tweet_buffered.wait()
+            time.sleep(self.flush_interval)
+            self.flush('time')
@@ -0,0 +1,64 @@
+"""Tests that the ring buffers keep results flowing to the ReorderBuffer when they overflow."""
+
+import unittest
+
+from ordering import ReorderBuffer
+from ringbuffer import ResultRing, TweetRing
+
+
+class RingBufferOverflowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rings = []
+
+    def tearDown(self):
+        for ring in self.rings:
+            ring.unlink()
+
+    def _make_ring(self, ring_class):
+        ring = ring_class(['apple'], capacity=200, reserve=100)
+        self.rings.append(ring)
+        return ring
+
+    def test_dropped_tweets_leave_placeholders(self):
+        ring = self._make_ring(TweetRing)
+        tweets = [(sequence_number, 'x' * 40, ('apple',)) for sequence_number in range(6)]
+
+        written = ring.put_many(tweets)
+
+        self.assertLess(written, len(tweets))
+        self.assertEqual(ring.overflow_count, len(tweets) - written)
+        received = ring.get_many(len(tweets), timeout=0)
+        self.assertEqual([tweet[0] for tweet in received], list(range(6)))
+        self.assertEqual(received[:written], tweets[:written])
+        self.assertTrue(all(tweet[1] is None for tweet in received[written:]))
+
+    def test_results_keep_flowing_after_overflow(self):
+        ring = self._make_ring(ResultRing)
+        reorder_buffer = ReorderBuffer()
+        released = []
+
+        for start in range(0, 18, 6):
+            results = [(sequence_number, ('x' * 40, 'pos', 1.0, ('apple',), False))
+                       for sequence_number in range(start, start + 6)]
+            written = ring.put_many(results)
+            self.assertLess(written, len(results))
+            for sequence_number, result in ring.get_many(len(results), timeout=0):
+                released.extend(reorder_buffer.add(sequence_number, result))
+            self.assertEqual(reorder_buffer.next_sequence, start + 6)
+
+        self.assertEqual(len(released), 18 - ring.overflow_count)
+        self.assertEqual(reorder_buffer.pending, {})
+
+    def test_results_keep_lower_bound_flag(self):
+        ring = self._make_ring(ResultRing)
+        results = [(0, ('good', 'pos', 0.5, ('apple',), True)),
+                   (1, ('bad', 'neg', 1.0, (), False))]
+
+        ring.put_many(results)
+
+        self.assertEqual(ring.get_many(len(results), timeout=0), results)
+
+
+if __name__ == '__main__':
+    unittest.main()
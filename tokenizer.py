@@ -0,0 +1,99 @@
+"""These classes split documents into words for building featuresets. NLTK's word_tokenize is
+accurate but slow, since it runs a sentence tokenizer and a long series of regexes over every
+document. TweetTokenizer does the same job with a single compiled regex that also understands
+URLs, mentions, hashtags and emoji. CachedTokenizer can wrap either of them so that repeated
+tweets are only tokenized once."""
+
+import abc
+import re
+
+from collections import OrderedDict
+
+from nltk import word_tokenize
+
+
+_ignored_pattern = re.compile(r'https?://\S+|www\.\S+|@\w+')
+
+
+def normalize(text):
+    """Returns text in lowercase with URLs and mentions removed and whitespace collapsed. Tweets
+    that are copies of each other apart from these details will normalize to the same text."""
+
+    return ' '.join(_ignored_pattern.sub(' ', text.lower()).split())
+
+
+class Tokenizer(abc.ABC):
+    """Base class for tokenizers. Subclasses must implement tokenize."""
+
+    @abc.abstractmethod
+    def tokenize(self, text):
+        """Returns a list of the tokens in text."""
+
+    def get_words(self, text):
+        """Returns a frozenset of the lowercase tokens in text."""
+
+        return frozenset(token.lower() for token in self.tokenize(text))
+
+
+class NltkTokenizer(Tokenizer):
+    """Tokenizes text with NLTK's word_tokenize."""
+
+    def tokenize(self, text):
+        return word_tokenize(text)
+
+
+class TweetTokenizer(Tokenizer):
+    """Tokenizes text with a single compiled regex. Words are split the same way NLTK's Treebank
+    tokenizer splits them, including contractions like "don't" -> "do", "n't", so that the
+    tokens match the words in the feature list. URLs, mentions, hashtags and emoji are kept as
+    single tokens."""
+
+    pattern = re.compile(r"""
+        https?://\S+ | www\.\S+                 # URLs
+        | [@\#]\w+                              # mentions and hashtags
+        | [\U0001F000-\U0001FAFF\u2600-\u27BF]  # emoji and pictographs
+        | (?i:can(?=not\b)) | (?i:not(?<=cannot))
+        | \w+(?=n't\b) | (?i:n't\b)             # contractions, as split by Treebank
+        | '(?i:s|m|d|re|ve|ll)\b
+        | \w+ (?:[-/`]+\w+ | '(?!(?i:s|m|d|re|ve|ll)\b)\w+)* -?  # words
+        | \.\.\. | --
+        | \S                                    # any other symbol
+        """, re.VERBOSE)
+
+    def tokenize(self, text):
+        return self.pattern.findall(text)
+
+    def get_words(self, text):
+        return frozenset(self.pattern.findall(text.lower()))
+
+
+class CachedTokenizer(Tokenizer):
+    """Wraps another tokenizer and remembers the words of the most recent max_size documents.
+    Documents are normalized first, so tweets that only differ by case, whitespace, URLs or
+    mentions share the same cache entry."""
+
+    def __init__(self, tokenizer, max_size=4096):
+        self.tokenizer = tokenizer
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def tokenize(self, text):
+        return self.tokenizer.tokenize(text)
+
+    def get_words(self, text):
+        key = normalize(text)
+
+        words = self.cache.get(key)
+        if words is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return words
+
+        self.misses += 1
+        words = self.tokenizer.get_words(key)
+        self.cache[key] = words
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return words
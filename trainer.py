@@ -5,25 +5,123 @@ times. It also uses the Singleton pattern to make the list of trained classifier
 without the risk of re-loading or re-training them."""
 
 import logging
+import multiprocessing
 import os
 import os.path
 import pickle
+import tempfile
 import time
 
 from nltk.classify.scikitlearn import SklearnClassifier
 
 from data import DataSet
+from modelbundle import ModelBundle
 
 
 class ClassifierTrainer:
 
     trained_classifiers = []
+    trained_models = []
+    bundle_filepath = os.path.join('pickles', 'models.bundle')
+    # (inode, modification time, size) of the bundle that trained_models were loaded from
+    bundle_version = None
+    # Number of classifiers trained at the same time, each in its own process
+    processes = os.cpu_count() or 1
+    # Words can be selected before training to make the models smaller and faster. 'chi2' or
+    # 'mutual_info' scores how much each word tells about the sentiment, and the max_features
+    # best words are kept, or those scoring at least min_feature_score, or both. None keeps
+    # every word
+    feature_selection = None
+    max_features = None
+    min_feature_score = None
+    # Shared with the forked training processes so that they do not have to be pickled
+    _training_matrix = None
+    _training_labels = None
+
+    @staticmethod
+    def get_trained_models(classifier_list):
+        """Returns a list of trained models loaded from the model bundle. The bundle is
+        memory-mapped, so it loads quickly and its memory is shared by every process that loads
+        it. If the bundle does not exist, or does not match classifier_list and the current
+        feature list, it is rebuilt from the trained classifiers. classifier_list is a list of
+        machine learning classifier constructor functions."""
+
+        ClassifierTrainer._apply_feature_selection()
+        if ClassifierTrainer.trained_models:
+            logging.debug("Returning cached models")
+            return ClassifierTrainer.trained_models
+
+        start = time.time()
+        bundle_filepath = ClassifierTrainer._get_bundle_filepath()
+        # Checked before loading, so that a bundle replaced while loading is not missed
+        bundle_version = ClassifierTrainer._get_file_version(bundle_filepath)
+        bundle = ModelBundle.load(bundle_filepath)
+
+        if not ClassifierTrainer._bundle_matches(bundle, classifier_list):
+            classifiers = ClassifierTrainer.get_trained_classifiers(classifier_list)
+            ModelBundle.export(bundle_filepath,
+                               [classifier.__name__ for classifier in classifier_list],
+                               classifiers,
+                               ClassifierTrainer._get_pickle_versions(classifier_list))
+            bundle_version = ClassifierTrainer._get_file_version(bundle_filepath)
+            bundle = ModelBundle.load(bundle_filepath)
+            # The bundle replaces the unpickled classifiers, so let them be garbage collected
+            ClassifierTrainer.trained_classifiers = []
+
+        logging.debug(f"Models loaded. Time taken: {time.time()-start}")
+        ClassifierTrainer.trained_models = bundle.models
+        ClassifierTrainer.bundle_version = bundle_version
+        return ClassifierTrainer.trained_models
+
+    @staticmethod
+    def get_updated_models(classifier_list):
+        """Returns a list of the models in the model bundle if it has been replaced since the
+        models were loaded, such as by the updater module, or None if it has not. The new
+        models also replace the cached ones. Checking only costs a stat of the bundle, so it
+        can be done between every batch of tweets. A bundle that does not match
+        classifier_list and the current feature list is ignored."""
+
+        bundle_filepath = ClassifierTrainer._get_bundle_filepath()
+        bundle_version = ClassifierTrainer._get_file_version(bundle_filepath)
+        if bundle_version is None or bundle_version == ClassifierTrainer.bundle_version:
+            return None
+
+        bundle = ModelBundle.load(bundle_filepath)
+        ClassifierTrainer.bundle_version = bundle_version
+        if not ClassifierTrainer._bundle_matches(bundle, classifier_list):
+            logging.error(f"{bundle_filepath} was replaced with different models, keeping the "
+                          f"current ones")
+            return None
+
+        logging.debug(f"Loaded updated models from {bundle_filepath}")
+        ClassifierTrainer.trained_models = bundle.models
+        return ClassifierTrainer.trained_models
+
+    @staticmethod
+    def replace_trained_classifiers(classifier_list, classifiers):
+        """Replaces the trained classifiers with classifiers, a list of trained
+        SklearnClassifiers in the same order as classifier_list, such as after they have been
+        updated with new data. They must use the current feature list. They are saved to their
+        pickles and to a new model bundle, which running processes pick up with
+        get_updated_models."""
+
+        named_classifiers = ClassifierTrainer._get_named_classifiers(classifier_list)
+        for named_classifier, classifier in zip(named_classifiers, classifiers):
+            named_classifier.classifier = classifier
+        ClassifierTrainer._save_classifiers_to_pickle(named_classifiers)
+        ModelBundle.export(ClassifierTrainer._get_bundle_filepath(),
+                           [named_classifier.name for named_classifier in named_classifiers],
+                           classifiers,
+                           ClassifierTrainer._get_pickle_versions(classifier_list))
+        ClassifierTrainer.trained_classifiers = named_classifiers
 
     @staticmethod
     def get_trained_classifiers(classifier_list):
         """Returns a list of trained classifiers. classifier_list is a list of machine learning
         classifier constructor functions."""
 
+        ClassifierTrainer._apply_feature_selection()
+
         # If trained classifiers are already ready to go, just return them
         if ClassifierTrainer.trained_classifiers:
             logging.debug("Returning cached classifiers")
@@ -45,7 +143,8 @@ class ClassifierTrainer:
 
             # Train classifiers
             data = DataSet.get_data()
-            ClassifierTrainer._train_classifiers(untrained_classifiers, data.training_set)
+            ClassifierTrainer._train_classifiers(untrained_classifiers, data.training_matrix,
+                                                 data.training_labels)
             DataSet.unload_data()
 
             # Pickle the trained classifiers to reduce future load times
@@ -57,6 +156,77 @@ class ClassifierTrainer:
         # Return list of trained classifiers
         return ClassifierTrainer._strip_names(ClassifierTrainer.trained_classifiers)
 
+    @staticmethod
+    def _apply_feature_selection():
+        """Passes the feature selection settings on to DataSet. If they have changed, the
+        cached classifiers and models were trained on other features, so they are forgotten."""
+
+        selection = None
+        if ClassifierTrainer.feature_selection is not None:
+            selection = (ClassifierTrainer.feature_selection, ClassifierTrainer.max_features,
+                         ClassifierTrainer.min_feature_score)
+        if DataSet.set_feature_selection(selection):
+            ClassifierTrainer.trained_classifiers = []
+            ClassifierTrainer.trained_models = []
+
+    @staticmethod
+    def _bundle_matches(bundle, classifier_list):
+        """Returns whether bundle holds the classifiers in classifier_list, exported from their
+        pickles as they are now and trained on the current feature list."""
+
+        return bundle is not None and \
+            bundle.get_names() == [classifier.__name__ for classifier in classifier_list] and \
+            bundle.sources == ClassifierTrainer._get_pickle_versions(classifier_list) and \
+            bundle.get_feature_index() == DataSet.get_feature_index()
+
+    @staticmethod
+    def _get_pickle_versions(classifier_list):
+        """Returns a dict of the name of each classifier in classifier_list -> the modification
+        time and size of its pickle, or None if it has no pickle. This is stored in the model
+        bundle, so that the bundle is rebuilt when a pickle is deleted or replaced."""
+
+        versions = {}
+        for classifier in classifier_list:
+            version = ClassifierTrainer._get_file_version(
+                ClassifierTrainer._get_pickle_filepath(classifier.__name__))
+            versions[classifier.__name__] = None if version is None else list(version[1:])
+        return versions
+
+    @staticmethod
+    def _get_file_version(filepath):
+        """Returns a tuple that changes whenever the file at filepath is replaced or modified,
+        or None if it does not exist."""
+
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _get_bundle_filepath():
+        """Returns bundle_filepath, with the name of the feature selection added if there is
+        one, so that bundles for different selections do not replace each other."""
+
+        return ClassifierTrainer._add_selection_name(ClassifierTrainer.bundle_filepath)
+
+    @staticmethod
+    def _get_pickle_filepath(name):
+        """Returns the path of the pickle of the classifier called name."""
+
+        return ClassifierTrainer._add_selection_name(os.path.join('pickles', name + '.pickle'))
+
+    @staticmethod
+    def _add_selection_name(filepath):
+        """Returns filepath with the name of the feature selection, if any, added before its
+        extension."""
+
+        selection_name = DataSet.get_feature_selection_name()
+        if selection_name is None:
+            return filepath
+        root, extension = os.path.splitext(filepath)
+        return f'{root}-{selection_name}{extension}'
+
     @staticmethod
     def _strip_names(named_classifier_list):
         """Returns a list of classifiers (not NamedClassifiers)."""
@@ -77,15 +247,53 @@ class ClassifierTrainer:
             named_classifier.classifier = SklearnClassifier(named_classifier.classifier())
 
     @staticmethod
-    def _train_classifiers(wrapped_named_classifier_list, training_set):
-        """Takes a list of SklearnClassifier-wrapped NamedClassifiers and trains each of
-        them."""
+    def _train_classifiers(wrapped_named_classifier_list, training_matrix, training_labels):
+        """Takes a list of SklearnClassifier-wrapped NamedClassifiers and trains each of them
+        on training_matrix, a sparse matrix with a row of features for each document, and
+        training_labels, an array of the sentiment of each row. The classifiers are
+        independent, so when processes can be forked, they are trained at the same time by a
+        pool of up to ClassifierTrainer.processes processes."""
+
+        start = time.time()
+        classifiers = [named_classifier.classifier
+                       for named_classifier in wrapped_named_classifier_list]
+        processes = min(ClassifierTrainer.processes, len(classifiers))
+
+        ClassifierTrainer._training_matrix = training_matrix
+        ClassifierTrainer._training_labels = training_labels
+        if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.map(ClassifierTrainer._train_classifier, classifiers,
+                                   chunksize=1)
+        else:
+            results = [ClassifierTrainer._train_classifier(classifier)
+                       for classifier in classifiers]
+        ClassifierTrainer._training_matrix = None
+        ClassifierTrainer._training_labels = None
+
+        for named_classifier, (classifier, time_taken) in zip(wrapped_named_classifier_list,
+                                                              results):
+            named_classifier.classifier = classifier
+            logging.debug(f"Trained {named_classifier.name}. Time taken: {time_taken}")
+        logging.debug(f"Training complete. Time taken: {time.time()-start}")
+
+    @staticmethod
+    def _train_classifier(classifier):
+        """Trains the SklearnClassifier classifier on ClassifierTrainer._training_matrix. The
+        matrix goes straight to the scikit-learn estimator, and the wrapper's DictVectorizer is
+        set up to match the matrix's columns, so the classifier still works with featuresets.
+        Returns the trained classifier and the time taken."""
+
+        start = time.time()
+
+        feature_index = DataSet.get_feature_index()
+        classifier._vectorizer.vocabulary_ = dict(feature_index)
+        classifier._vectorizer.feature_names_ = sorted(feature_index, key=feature_index.get)
+
+        labels = classifier._encoder.fit_transform(ClassifierTrainer._training_labels)
+        classifier._clf.fit(ClassifierTrainer._training_matrix, labels)
 
-        for named_classifier in wrapped_named_classifier_list:
-            logging.debug(f"Training {named_classifier.name}")
-            start = time.time()
-            named_classifier.classifier.train(training_set)
-            logging.debug(f"Training complete. Time taken: {time.time()-start}")
+        return classifier, time.time() - start
 
     @staticmethod
     def _load_classifier_pickles(named_classifier_list):
@@ -94,11 +302,10 @@ class ClassifierTrainer:
         pickle and are ready to go. The second is a list of classifiers that could not be
         loaded and need to be loaded manually."""
 
-        pickle_folder = 'pickles'
         unloaded_classifiers = []
         loaded_classifiers = []
         for named_classifier in named_classifier_list:
-            pickle_filepath = os.path.join(pickle_folder, named_classifier.name + '.pickle')
+            pickle_filepath = ClassifierTrainer._get_pickle_filepath(named_classifier.name)
             if os.path.isfile(pickle_filepath):
                 logging.debug(f"Loading {named_classifier.name} from pickle")
                 with open(pickle_filepath, 'rb') as pickle_file:
@@ -111,16 +318,23 @@ class ClassifierTrainer:
 
     @staticmethod
     def _save_classifiers_to_pickle(trained_classifiers):
-        """Saves the pre-trained classifiers to pickle files."""
+        """Saves the pre-trained classifiers to pickle files. Each file is written under a
+        unique temporary name and then renamed, so a process loading it never sees half of it,
+        and processes saving the same classifier at once do not write over each other."""
 
-        if not os.path.isdir('pickles'):
-            os.mkdir('pickles')
+        os.makedirs('pickles', exist_ok=True)
         for trained_classifier in trained_classifiers:
-            pickle_filepath = os.path.join('pickles', trained_classifier.name + '.pickle')
-            with open(pickle_filepath, 'wb') as pickle_file:
-                logging.debug(f"Writing {trained_classifier.name} to pickle file")
-                pickle.dump(trained_classifier.classifier, pickle_file,
-                            protocol=pickle.HIGHEST_PROTOCOL)
+            pickle_filepath = ClassifierTrainer._get_pickle_filepath(trained_classifier.name)
+            file_descriptor, temp_filepath = tempfile.mkstemp(suffix='.tmp', dir='pickles')
+            try:
+                with open(file_descriptor, 'wb') as pickle_file:
+                    logging.debug(f"Writing {trained_classifier.name} to pickle file")
+                    pickle.dump(trained_classifier.classifier, pickle_file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_filepath, pickle_filepath)
+            except BaseException:
+                os.remove(temp_filepath)
+                raise
 
 
 class NamedClassifier:
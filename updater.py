@@ -0,0 +1,184 @@
+"""This module keeps the classifiers up to date with newly labeled tweets while the program
+runs, without restarting it. The updater process follows a file of labeled tweets, one per line
+as a label (pos or neg), a tab, then the text of the tweet, and picks up every line that is
+added to it. The classifiers that can learn incrementally (ONLINE_CLASSIFIERS) are updated with
+partial_fit every few labeled tweets. The others have to be trained from scratch, so once
+enough labeled tweets have arrived they are retrained in a background process on the corpus
+plus every tweet in the file, while the stream carries on with the current models.
+
+Each new version of the models is saved to the pickles and written to a new model bundle, which
+replaces the old one in a single rename. The classification processes notice the new bundle and
+swap it in between two batches. Only the weights are updated, so words that are not in the
+feature list are still ignored."""
+
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from data import DataSet
+from metrics import Metrics
+from trainer import ClassifierTrainer
+from votingclassifier import VotingClassifier
+
+
+ONLINE_CLASSIFIERS = ('SGDClassifier', 'MultinomialNB', 'BernoulliNB')
+LABELS = ('pos', 'neg')
+# Seconds between checks for new lines in the file of labeled tweets
+POLL_INTERVAL = 1
+# The online classifiers are updated once this many labeled tweets are waiting, or once the
+# oldest has waited UPDATE_INTERVAL seconds
+UPDATE_SIZE = 50
+UPDATE_INTERVAL = 10
+# The other classifiers are retrained after this many labeled tweets
+RETRAIN_SIZE = 500
+
+
+def start_updater(labels_filepath, stop_event, metrics_queue=None, update_size=UPDATE_SIZE,
+                  update_interval=UPDATE_INTERVAL, retrain_size=RETRAIN_SIZE):
+    """Follows the file of labeled tweets at labels_filepath, which does not have to exist yet,
+    and updates the classifiers with every line added to it from now on. The online
+    classifiers are updated with batches of up to update_size tweets, at least every
+    update_interval seconds while tweets are waiting. The other classifiers are retrained in a
+    background process after every retrain_size tweets, one retraining at a time. Runs until
+    stop_event is set. Metrics are sent to metrics_queue, if it is given."""
+
+    Metrics.connect(metrics_queue)
+    classifier_list = VotingClassifier.classifier_list
+    classifiers = ClassifierTrainer.get_trained_classifiers(classifier_list)
+    offline_classifier_list = [classifier for classifier in classifier_list
+                               if classifier.__name__ not in ONLINE_CLASSIFIERS]
+
+    # Only lines added from now on are new. The lines already in the file were learned when
+    # they were added, and are only used again when retraining
+    offset = os.path.getsize(labels_filepath) if os.path.isfile(labels_filepath) else 0
+    logging.debug(f"Following labeled tweets in {labels_filepath}")
+
+    waiting_tweets = []
+    first_waiting_time = None
+    tweets_since_retraining = 0
+    pool = None
+    retraining = None
+
+    while not stop_event.wait(POLL_INTERVAL):
+
+        labeled_tweets, offset = _read_labeled_tweets(labels_filepath, offset)
+        if labeled_tweets:
+            Metrics.increment('labeled_tweets_total', len(labeled_tweets))
+            if not waiting_tweets:
+                first_waiting_time = time.time()
+            waiting_tweets.extend(labeled_tweets)
+
+        updated = False
+        if len(waiting_tweets) >= update_size or \
+                (waiting_tweets and time.time() - first_waiting_time > update_interval):
+            for batch_start in range(0, len(waiting_tweets), update_size):
+                batch = waiting_tweets[batch_start:batch_start + update_size]
+                _update_online_classifiers(classifier_list, classifiers, batch)
+            Metrics.increment('model_updates_total', kind='online')
+            tweets_since_retraining += len(waiting_tweets)
+            waiting_tweets = []
+            updated = True
+
+        if retraining is not None and retraining.ready():
+            try:
+                _replace_classifiers(classifier_list, classifiers, retraining.get())
+                Metrics.increment('model_updates_total', kind='retrain')
+                updated = True
+            except Exception as e:
+                logging.error(f"Retraining failed: {e}")
+            retraining = None
+
+        if retraining is None and offline_classifier_list and \
+                tweets_since_retraining >= retrain_size:
+            # Daemonic pool processes cannot start processes of their own, so the retraining
+            # runs in a single process, which also leaves the other CPUs to classification
+            if pool is None:
+                pool = multiprocessing.Pool(1)
+            retraining = pool.apply_async(_retrain, (offline_classifier_list, labels_filepath,
+                                                     DataSet.feature_selection))
+            tweets_since_retraining = 0
+
+        if updated:
+            start = time.time()
+            ClassifierTrainer.replace_trained_classifiers(classifier_list, classifiers)
+            logging.debug(f"Saved updated models. Time taken: {time.time()-start}")
+
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+    logging.debug("Stopped updating the models")
+
+
+def _read_labeled_tweets(filepath, offset):
+    """Returns a list of (text, label) tuples for the complete lines of the file at filepath
+    after byte offset, and the offset of the end of the last complete line. A line that is
+    still being written is left for next time. If the file has been truncated, it is read from
+    the start again."""
+
+    try:
+        with open(filepath, 'rb') as labels_file:
+            if os.fstat(labels_file.fileno()).st_size < offset:
+                offset = 0
+            labels_file.seek(offset)
+            data = labels_file.read()
+    except FileNotFoundError:
+        return [], offset
+
+    end = data.rfind(b'\n') + 1
+    labeled_tweets = []
+    for line in data[:end].decode('utf-8', errors='replace').splitlines():
+        label, _, text = line.partition('\t')
+        label = label.strip().lower()
+        if label in LABELS and text.strip():
+            labeled_tweets.append((text.strip(), label))
+        elif line.strip():
+            logging.error(f"Skipping badly formed labeled tweet: {line!r}")
+    return labeled_tweets, offset + end
+
+
+def _update_online_classifiers(classifier_list, classifiers, labeled_tweets):
+    """Updates each classifier in classifiers whose constructor in classifier_list is in
+    ONLINE_CLASSIFIERS with labeled_tweets, a list of (text, label) tuples."""
+
+    texts, labels = zip(*labeled_tweets)
+    features = DataSet.find_feature_matrix(texts, DataSet.get_feature_index())
+    for constructor, classifier in zip(classifier_list, classifiers):
+        if constructor.__name__ in ONLINE_CLASSIFIERS:
+            classifier._clf.partial_fit(features, classifier._encoder.transform(labels))
+
+
+def _replace_classifiers(classifier_list, classifiers, retrained_classifiers):
+    """Replaces the classifiers in classifiers with the retrained classifiers in
+    retrained_classifiers, a dict of name -> classifier."""
+
+    for i, constructor in enumerate(classifier_list):
+        if constructor.__name__ in retrained_classifiers:
+            classifiers[i] = retrained_classifiers[constructor.__name__]
+
+
+def _retrain(classifier_list, labels_filepath, feature_selection):
+    """Trains the classifiers in classifier_list from scratch on the corpus and every labeled
+    tweet in the file at labels_filepath, using the feature list of feature_selection. Runs in
+    a pool process. Returns a dict of name -> trained SklearnClassifier."""
+
+    start = time.time()
+    ClassifierTrainer.processes = 1
+    DataSet.processes = 1
+    DataSet.set_feature_selection(feature_selection)
+
+    documents = []
+    DataSet._load_movie_reviews(documents)
+    documents.extend(_read_labeled_tweets(labels_filepath, 0)[0])
+    training_matrix = DataSet._build_training_matrix(documents, DataSet.get_feature_index())
+    training_labels = np.array([label for _, label in documents])
+
+    named_classifiers = ClassifierTrainer._get_named_classifiers(classifier_list)
+    ClassifierTrainer._wrap_named_classifiers(named_classifiers)
+    ClassifierTrainer._train_classifiers(named_classifiers, training_matrix, training_labels)
+    logging.debug(f"Retrained {len(named_classifiers)} classifiers on {len(documents)} "
+                  f"documents. Time taken: {time.time()-start}")
+    return {named_classifier.name: named_classifier.classifier
+            for named_classifier in named_classifiers}
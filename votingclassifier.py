@@ -2,36 +2,179 @@
 classify a text, then return a majority vote of the classifications determined by the multiple
 classifiers."""
 
-import statistics
+import time
 
+import numpy as np
 from nltk import ClassifierI
+from scipy.sparse import random as sparse_random
 from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.naive_bayes import MultinomialNB, BernoulliNB
 from sklearn.neural_network import MLPClassifier
 from sklearn.svm import LinearSVC
 from sklearn.tree import DecisionTreeClassifier
 
+from data import DataSet
+from linearensemble import LinearEnsemble
+from metrics import Metrics
+from modelbundle import LinearModel
 from trainer import ClassifierTrainer
 
 
 class VotingClassifier(ClassifierI):
 
-    def __init__(self):
+    classifier_list = [MultinomialNB, BernoulliNB, LogisticRegression, SGDClassifier,
+                       LinearSVC, DecisionTreeClassifier, MLPClassifier]
+
+    def __init__(self, compiled=True, cascade=False):
+        """If compiled is True, the linear classifiers are scored together by a LinearEnsemble
+        and only the other classifiers are run on their own. The votes are exactly the same
+        either way.
+
+        If cascade is True, the classifiers are run from cheapest to most expensive, and each
+        tweet stops being classified as soon as enough classifiers agree that the rest cannot
+        change the majority. The confidence of a tweet that stopped early is only a lower
+        bound, since the skipped classifiers might also have agreed. The tweets this applies
+        to are listed in confidence_is_lower_bound after each classification, and the number
+        of classifiers skipped for each tweet in evaluations_saved."""
+
+        self.compiled = compiled
         self.classifiers = self._get_classifiers()
+        self.labels = self.classifiers[0].labels
         self.confidence = None
 
+        self.linear_ensemble = None
+        separate_classifiers = self.classifiers
+        linear_models = [classifier for classifier in self.classifiers
+                         if isinstance(classifier, LinearModel)]
+        # Without any linear models there is nothing to stack, so every model runs on its own
+        if compiled and linear_models:
+            self.linear_ensemble = LinearEnsemble(linear_models)
+            separate_classifiers = [classifier for classifier in self.classifiers
+                                    if not isinstance(classifier, LinearModel)]
+
+        # Each stage has a name, a function that returns a list of predictions, and the number
+        # of predictions (votes) it returns
+        self.stages = [('LinearEnsemble', self.linear_ensemble.predict,
+                        len(self.linear_ensemble.models))] if self.linear_ensemble else []
+        self.stages += [(classifier.name,
+                         lambda X, classifier=classifier: [classifier.predict(X)], 1)
+                        for classifier in separate_classifiers]
+
+        self.cascade = cascade
+        if cascade:
+            self._sort_stages_by_cost()
+        self.confidence_is_lower_bound = []
+        self.evaluations_saved = []
+        self.total_evaluations_saved = 0
+
     def _get_classifiers(self):
-        classifier_list = [MultinomialNB, BernoulliNB, LogisticRegression, SGDClassifier,
-                           LinearSVC, DecisionTreeClassifier, MLPClassifier]
-        return ClassifierTrainer.get_trained_classifiers(classifier_list)
+        return ClassifierTrainer.get_trained_models(VotingClassifier.classifier_list)
+
+    def get_updated_classifier(self):
+        """Returns a new VotingClassifier with the same settings if the models have been
+        updated since this one was made, or None if they have not. This one keeps using the
+        models it has, so it can go on classifying until the new one replaces it."""
+
+        if ClassifierTrainer.get_updated_models(VotingClassifier.classifier_list) is None:
+            return None
+        classifier = VotingClassifier(compiled=self.compiled, cascade=self.cascade)
+        classifier.total_evaluations_saved = self.total_evaluations_saved
+        return classifier
 
     def classify(self, featureset):
-        results = []
-        for classifier in self.classifiers:
-            results.append(classifier.classify(featureset))
-        mode = statistics.mode(results)
-        self.confidence = results.count(mode) / len(results)
-        return mode
+        feature_vector = DataSet.featureset_to_vector(featureset, DataSet.get_feature_index())
+        return self.classify_vector(feature_vector)
+
+    def classify_vector(self, feature_vector):
+        """Classifies a sparse featureset built by DataSet.find_feature_vector. The same row is
+        given directly to every model, so it is only vectorized once."""
+
+        labels, confidences = self.classify_matrix(feature_vector)
+        self.confidence = confidences[0]
+        return labels[0]
+
+    def classify_matrix(self, feature_matrix):
+        """Classifies every row of a sparse matrix built by DataSet.find_feature_matrix. Each
+        classifier makes one prediction over the whole matrix, and the votes are counted with
+        array operations. Returns a list of labels and a list of confidences, one per row."""
+
+        if self.cascade:
+            return self._classify_matrix_cascade(feature_matrix)
+
+        votes = np.array([prediction for name, predict, _ in self.stages
+                          for prediction in VotingClassifier._run_stage(name, predict,
+                                                                        feature_matrix)])
+        vote_counts = np.array([np.count_nonzero(votes == label, axis=0)
+                                for label in self.labels])
+        return self._count_votes(vote_counts)
+
+    def _classify_matrix_cascade(self, feature_matrix):
+        """Classifies every row of feature_matrix, running each stage only on the rows whose
+        majority is not yet decided."""
+
+        rows = feature_matrix.shape[0]
+        vote_counts = np.zeros((len(self.labels), rows), dtype=int)
+        votes_counted = np.zeros(rows, dtype=int)
+        undecided = np.arange(rows)
+        remaining_votes = len(self.classifiers)
+
+        for name, predict, vote_count in self.stages:
+            if undecided.size == 0:
+                break
+            for prediction in VotingClassifier._run_stage(name, predict,
+                                                          feature_matrix[undecided]):
+                for label_number, label in enumerate(self.labels):
+                    vote_counts[label_number, undecided] += prediction == label
+            votes_counted[undecided] += vote_count
+            remaining_votes -= vote_count
+
+            # A row is decided once the remaining votes could not make the runner-up win
+            counts = np.sort(vote_counts[:, undecided], axis=0)
+            undecided = undecided[counts[-1] <= counts[-2] + remaining_votes]
+
+        evaluations_saved = len(self.classifiers) - votes_counted
+        self.confidence_is_lower_bound = (evaluations_saved > 0).tolist()
+        self.evaluations_saved = evaluations_saved.tolist()
+        self.total_evaluations_saved += int(evaluations_saved.sum())
+        return self._count_votes(vote_counts)
+
+    @staticmethod
+    def _run_stage(name, predict, feature_matrix):
+        """Returns the predictions of a stage for feature_matrix, and records how long the
+        stage took in the classify_seconds metric."""
+
+        start = time.perf_counter()
+        predictions = predict(feature_matrix)
+        Metrics.observe('classify_seconds', time.perf_counter() - start, model=name)
+        return predictions
+
+    def _count_votes(self, vote_counts):
+        """Returns a list of the winning label of each row and a list of their share of all of
+        the classifiers' votes. vote_counts has a row for each label and a column for each
+        row of features."""
+
+        winners = vote_counts.argmax(axis=0)
+        confidences = vote_counts[winners, np.arange(vote_counts.shape[1])] / \
+            len(self.classifiers)
+        return self.labels[winners].tolist(), confidences.tolist()
+
+    def _sort_stages_by_cost(self):
+        """Sorts the stages from fastest to slowest, timed on a batch of random features."""
+
+        sample = sparse_random(64, len(DataSet.get_feature_index()), density=0.001,
+                               format='csr', random_state=0)
+        sample.data[:] = 1.0
+
+        def get_cost(stage):
+            _, predict, _ = stage
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                predict(sample)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        self.stages.sort(key=get_cost)
 
     def get_most_recent_confidence(self):
         return self.confidence
@@ -0,0 +1,96 @@
+"""This module counts the words in the most recent tweets for the word cloud. WordCounter keeps
+a running count that is updated as each tweet arrives and leaves, instead of joining every
+recent tweet into one text and tokenizing all of it whenever the word cloud is redrawn. The
+counts are given to WordCloud as frequencies. Laying out a word cloud is slow, so
+render_word_cloud is run in a separate process by the graphing module."""
+
+import heapq
+import re
+import string
+import time
+
+from collections import deque
+
+from wordcloud import WordCloud, STOPWORDS
+
+
+class WordCounter:
+    """Counts the words in the last max_tweets tweets, ignoring stopwords and numbers. Words
+    are found the same way WordCloud finds them in a text, but in lowercase."""
+
+    word_pattern = re.compile(r"\w[\w']*")
+
+    def __init__(self, max_tweets, stopwords=()):
+        self.max_tweets = max_tweets
+        self.stopwords = set(stopwords)
+        # The words of each tweet, oldest first
+        self.tweets = deque()
+        self.counts = {}
+
+    def add(self, text):
+        """Counts the words in text. If there are already max_tweets tweets, the words of the
+        oldest one stop being counted."""
+
+        if len(self.tweets) == self.max_tweets:
+            for word in self.tweets.popleft():
+                count = self.counts[word] - 1
+                if count:
+                    self.counts[word] = count
+                else:
+                    del self.counts[word]
+
+        words = self._get_words(text)
+        for word in words:
+            self.counts[word] = self.counts.get(word, 0) + 1
+        self.tweets.append(words)
+
+    def get_frequencies(self, max_words=200):
+        """Returns a dict of the max_words most common words and their counts."""
+
+        return dict(heapq.nlargest(max_words, self.counts.items(), key=lambda item: item[1]))
+
+    def _get_words(self, text):
+        """Returns a list of the words in text that are not stopwords or numbers."""
+
+        words = []
+        for word in WordCounter.word_pattern.findall(text.lower()):
+            if word.endswith("'s"):
+                word = word[:-2]
+            if word and word not in self.stopwords and not word.isdigit():
+                words.append(word)
+        return words
+
+
+def get_stopwords():
+    """Returns a set of stopwords that should be ignored in the word cloud."""
+
+    stopwords = list(STOPWORDS)
+
+    for word in ('http', 'https', 'amp'):
+        stopwords.append(word)
+
+    # Add 1 and 2 letter permutations. This helps exclude common foreign words, shortened
+    # url's, and so forth
+    for c1 in string.ascii_lowercase:
+        stopwords.append(c1)
+        for c2 in string.ascii_lowercase:
+            stopwords.append(c1 + c2)
+
+    return set(stopwords)
+
+
+_word_cloud_generator = None
+
+
+def render_word_cloud(frequencies):
+    """Lays out a word cloud of the words in the dict frequencies. Returns the word cloud as an
+    RGB image array, and the number of seconds the layout took."""
+
+    global _word_cloud_generator
+    if _word_cloud_generator is None:
+        _word_cloud_generator = WordCloud(background_color='white', height=400, width=1000,
+                                          min_font_size=9, prefer_horizontal=.8)
+
+    start = time.time()
+    image = _word_cloud_generator.generate_from_frequencies(frequencies).to_array()
+    return image, time.time() - start